@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Cache module
+cache.py -- snapshots of standings and pairings keyed by tournament and the
+result version of the tournament. A new version is committed with every
+change of results or participants, so a snapshot never has to be deleted;
+it is just not asked for any more.
+"""
+
+import cPickle as pickle
+import threading
+from collections import OrderedDict
+
+
+class LocalCache(object):
+    """ Cache backend in the memory of the process """
+
+    def __init__(self, size=256):
+        """
+        Constructor of LocalCache class.
+        :param size: The maximum number of snapshots kept. The least recently
+                     used snapshot is dropped first.
+        :return:
+        """
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the snapshot of the key.
+        :param key: Cache key.
+        :return: The snapshot, or None if it is not cached.
+        """
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Keep the snapshot of the key.
+        :param key: Cache key.
+        :param value: The snapshot.
+        :return:
+        """
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+class RedisCache(object):
+    """ Cache backend shared by processes through a Redis server """
+
+    def __init__(self, client=None, url="redis://localhost:6379/0",
+                 ttl=3600, prefix="tournament:"):
+        """
+        Constructor of RedisCache class. The redis package is needed only
+        when this backend is used.
+        :param client: Redis client or any object with the get and setex
+                       methods of it. A client for the url is created if None.
+        :param url: URL of the Redis server.
+        :param ttl: Seconds a snapshot is kept, since outdated versions are
+                    never asked for again.
+        :param prefix: Prefix of the keys.
+        :return:
+        """
+        if client is None:
+            import redis
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        """
+        Get the snapshot of the key.
+        :param key: Cache key.
+        :return: The snapshot, or None if it is not cached.
+        """
+        data = self.client.get(self.prefix + key)
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        """
+        Keep the snapshot of the key.
+        :param key: Cache key.
+        :param value: The snapshot.
+        :return:
+        """
+        self.client.setex(self.prefix + key, self.ttl,
+                          pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class StandingsCache(object):
+    """ Snapshots of tournaments with hit and miss counters """
+
+    def __init__(self, backend=None):
+        """
+        Constructor of StandingsCache class.
+        :param backend: LocalCache, RedisCache or any object with the same
+                        get and set methods. LocalCache if None.
+        :return:
+        """
+        self.backend = backend if backend is not None else LocalCache()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, t_id, version, *args):
+        """
+        Cache key of a snapshot.
+        :param kind: Kind of the snapshot like "standings".
+        :param t_id: Tournament ID.
+        :param version: Result version of the tournament.
+        :param args: Other arguments, which the snapshot depends on.
+        :return: Cache key.
+        """
+        return ":".join([kind, str(t_id), str(version)] +
+                        [",".join(arg) if isinstance(arg, (list, tuple))
+                         else str(arg) for arg in args])
+
+    def get(self, key):
+        """
+        Get the snapshot of the key and count a hit or a miss.
+        :param key: Cache key.
+        :return: A copy of the snapshot, or None if it is not cached.
+        """
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return list(value)
+
+    def set(self, key, value):
+        """
+        Keep a copy of the snapshot.
+        :param key: Cache key.
+        :param value: List of rows.
+        :return:
+        """
+        self.backend.set(key, list(value))
+
+    def stats(self):
+        """
+        Hit and miss counters.
+        :return: Dictionary of hits, misses and hit_rate.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0}
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Standings export
+export.py -- stream the standings of a tournament to a CSV or JSON lines
+file in constant memory, for scoreboard feeds.
+
+The first line of a JSON lines export is a header object with the version of
+the snapshot, which is given as --since to the next export to get only the
+standings changed after it, and "full", which is false when only the changed
+standings follow. A CSV export has the same columns and the header object is
+written to stderr.
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+from tournament import Tournament, connect
+
+COLUMNS = ("id", "name", "wins", "matches", "tiebreak", "score")
+
+
+def write_csv(out, rows):
+    """
+    Write standings to a CSV file.
+    :param out: File object.
+    :param rows: Iterable of tuples of
+                 (id, name, wins, matches, tiebreak, score).
+    :return: The number of rows written.
+    """
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(out, rows, header):
+    """
+    Write standings to a JSON lines file after the header object.
+    :param out: File object.
+    :param rows: Iterable of tuples of
+                 (id, name, wins, matches, tiebreak, score).
+    :param header: Dictionary written as the first line.
+    :return: The number of rows written.
+    """
+    out.write(json.dumps(header) + "\n")
+    count = 0
+    for row in rows:
+        out.write(json.dumps(dict(zip(COLUMNS, row))) + "\n")
+        count += 1
+    return count
+
+
+def export_standings(tournament, out, format="jsonl", since=None,
+                     itersize=2000):
+    """
+    Export the standings of the tournament from one snapshot. Rows are
+    streamed from a server-side cursor, so only itersize rows are held in
+    memory at a time.
+    :param tournament: Tournament.
+    :param out: File object.
+    :param format: "csv" or "jsonl".
+    :param since: Version of the previous export. All standings if None.
+    :param itersize: The number of rows fetched per round trip.
+    :return: Dictionary of the header with the number of rows written.
+    """
+    if format not in ("csv", "jsonl"):
+        raise ValueError("Unknown format, %s." % format)
+    version, full, rows = tournament.standings_changes(since, itersize)
+    header = {"tournament": tournament.t_name, "version": version,
+              "since": since, "full": full}
+    if format == "csv":
+        header["rows"] = write_csv(out, rows)
+    else:
+        header["rows"] = write_jsonl(out, rows, header)
+    return header
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the standings of a tournament.")
+    parser.add_argument("-t", "--tournament", default=Tournament.default,
+                        help="tournament name (default: %(default)s)")
+    parser.add_argument("-f", "--format", choices=("csv", "jsonl"),
+                        default="jsonl", help="output format")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--since", type=int,
+                        help="export only standings changed after this "
+                             "version")
+    args = parser.parse_args()
+
+    tournament = Tournament(connect(), args.tournament)
+    if args.output:
+        out = open(args.output, "wb")
+    else:
+        out = sys.stdout
+    try:
+        header = export_standings(tournament, out, args.format, args.since)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        tournament.close()
+    if args.format == "csv" or args.output:
+        sys.stderr.write(json.dumps(header) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+History module
+history.py -- who played whom in a tournament, kept in a compact form for
+O(1) "have these two met" checks by pairing and tiebreaks
+"""
+
+from array import array
+
+
+class OpponentHistory(object):
+    """ Opponents and byes of the players of a tournament """
+
+    def __init__(self):
+        """
+        Constructor of OpponentHistory class. Players are numbered in the
+        order they are added, and each match is kept once as an integer
+        made of the numbers of both players.
+        :return:
+        """
+        self.ids = []
+        self.index = {}
+        self.met = set()
+        self.opponent_indexes = []
+        self.played = array("i")
+        self.byes = set()
+
+    @classmethod
+    def from_opponents(cls, opponents, byes=()):
+        """
+        Build the history from a dictionary of opponents.
+        :param opponents: Dictionary of player ID to the player IDs the
+                          player has already played.
+        :param byes: Player IDs, who already had a bye.
+        :return: OpponentHistory.
+        """
+        history = cls()
+        for p_id, played in opponents.iteritems():
+            for opponent in played:
+                if not history.have_met(p_id, opponent):
+                    history.add_match(p_id, opponent)
+            history.add_player(p_id)
+        for p_id in byes:
+            history.add_bye(p_id)
+        return history
+
+    def add_player(self, p_id):
+        """
+        Add a player without matches.
+        :param p_id: Player ID.
+        :return: Number of the player.
+        """
+        i = self.index.get(p_id)
+        if i is None:
+            i = self.index[p_id] = len(self.ids)
+            self.ids.append(p_id)
+            self.opponent_indexes.append(array("i"))
+            self.played.append(0)
+        return i
+
+    @staticmethod
+    def __key(i, j):
+        """
+        Key of the match between the players of the given numbers.
+        :param i: Number of a player.
+        :param j: Number of the other player.
+        :return: Integer, which is the same for (i, j) and (j, i).
+        """
+        if i > j:
+            i, j = j, i
+        return i << 32 | j
+
+    def add_match(self, p1, p2):
+        """
+        Add a match between two players.
+        :param p1: Player ID of a player.
+        :param p2: Player ID of the other player.
+        :return:
+        """
+        i, j = self.add_player(p1), self.add_player(p2)
+        self.met.add(self.__key(i, j))
+        self.opponent_indexes[i].append(j)
+        self.opponent_indexes[j].append(i)
+        self.played[i] += 1
+        self.played[j] += 1
+
+    def add_bye(self, p_id):
+        """
+        Add a bye, which counts as a match without opponent.
+        :param p_id: Player ID.
+        :return:
+        """
+        i = self.add_player(p_id)
+        self.byes.add(p_id)
+        self.played[i] += 1
+
+    def have_met(self, p1, p2):
+        """
+        Check whether two players have played each other.
+        :param p1: Player ID of a player.
+        :param p2: Player ID of the other player.
+        :return: True if they have met.
+        """
+        i, j = self.index.get(p1), self.index.get(p2)
+        if i is None or j is None:
+            return False
+        return self.__key(i, j) in self.met
+
+    def had_bye(self, p_id):
+        """
+        Check whether the player already had a bye.
+        :param p_id: Player ID.
+        :return: True if the player had a bye.
+        """
+        return p_id in self.byes
+
+    def opponents(self, p_id):
+        """
+        Opponents of the player in the order they were played.
+        :param p_id: Player ID.
+        :return: List of player IDs.
+        """
+        i = self.index.get(p_id)
+        if i is None:
+            return []
+        ids = self.ids
+        return [ids[j] for j in self.opponent_indexes[i]]
+
+    def matches(self, p_id):
+        """
+        The number of matches of the player including byes.
+        :param p_id: Player ID.
+        :return: The number of matches.
+        """
+        i = self.index.get(p_id)
+        return 0 if i is None else self.played[i]
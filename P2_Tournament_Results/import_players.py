@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Player import
+import_players.py -- register players from a CSV or JSON lines file and add
+them to a tournament in one transaction.
+
+CSV files need a header with a "name" column and optionally an "id" column.
+JSON lines files have one object with "name" and optionally "id" per line.
+Players without ID get the same ID as registerPlayer gives them.
+"""
+
+import argparse
+import csv
+import json
+
+from tournament import Tournament, connect, player_id
+
+
+def read_csv(path):
+    """
+    Read players from a CSV file.
+    :param path: Path of the CSV file.
+    :return: Generator of tuples of (player ID, name).
+    """
+    with open(path, "rb") as f:
+        for row in csv.DictReader(f):
+            yield row.get("id") or player_id(row["name"]), row["name"]
+
+
+def read_jsonl(path):
+    """
+    Read players from a JSON lines file.
+    :param path: Path of the JSON lines file.
+    :return: Generator of tuples of (player ID, name).
+    """
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row.get("id") or player_id(row["name"]), row["name"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Register players from a CSV or JSON lines file.")
+    parser.add_argument("path", help="CSV (.csv) or JSON lines file")
+    parser.add_argument("-t", "--tournament", default=Tournament.default,
+                        help="tournament name (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.path.endswith(".csv"):
+        rows = read_csv(args.path)
+    else:
+        rows = read_jsonl(args.path)
+    tournament = Tournament(connect(), args.tournament)
+    inserted, skipped = tournament.register_players(rows)
+    tournament.close()
+    print "%d players inserted, %d skipped." % (inserted, skipped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Instrumentation module
+instrument.py -- opt-in query instrumentation of the Tournament class. A
+connection made by Instrument.connect() records queries, database time, rows
+and commits per Tournament method, and logs slow statements with their
+parameters and EXPLAIN plan.
+
+    instrument = Instrument(slow=0.05)
+    tournament = Tournament(instrument.connect(), "Full Stack Developer Cup")
+    ...
+    print instrument.report()
+    instrument.write_prometheus("tournament.prom")
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from tournament import DSN, Tournament
+
+log = logging.getLogger(__name__)
+
+# Statements, which EXPLAIN can show the plan of. Tournament runs its queries
+# as "execute" of prepared statements.
+EXPLAINABLE = ("select", "insert", "update", "delete", "with", "execute")
+
+
+def _method():
+    """
+    Name of the outermost Tournament method on the call stack, so that the
+    queries of private helpers are counted for the public method, which
+    called them.
+    :return: The method name, or "other" if no Tournament method is found.
+    """
+    method = "other"
+    frame = sys._getframe(2)
+    while frame is not None:
+        if isinstance(frame.f_locals.get("self"), Tournament):
+            method = frame.f_code.co_name
+        frame = frame.f_back
+    return method
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """ Cursor, which records its statements to the Instrument of its
+    connection. """
+
+    def execute(self, query, vars=None):
+        start = time.time()
+        try:
+            return super(InstrumentedCursor, self).execute(query, vars)
+        finally:
+            seconds = time.time() - start
+            instrument = self.connection.instrument
+            method = _method()
+            instrument.record(method, seconds, max(self.rowcount, 0))
+            if seconds >= instrument.slow:
+                instrument.slow_query(self.connection, method, seconds,
+                                      query, vars)
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """ Connection, which makes instrumented cursors and records commits. """
+
+    instrument = None
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedConnection, self).__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+
+    def commit(self):
+        start = time.time()
+        try:
+            return super(InstrumentedConnection, self).commit()
+        finally:
+            self.instrument.record(_method(), time.time() - start, 0, 1)
+
+
+class Instrument(object):
+    """ Query statistics per Tournament method and the slow-query log """
+
+    def __init__(self, slow=0.1, explain=True):
+        """
+        Constructor of Instrument class.
+        :param slow: Seconds, after which a statement is logged as slow.
+        :param explain: True to log the EXPLAIN plan of slow statements.
+        :return:
+        """
+        self.slow = slow
+        self.explain = explain
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.slow_queries = 0
+        self.connection_factory = type("InstrumentedConnection",
+                                       (InstrumentedConnection, ),
+                                       {"instrument": self})
+
+    def connect(self, dsn=DSN):
+        """
+        Connect to the database with instrumentation.
+        :param dsn: Connection string of the tournament database.
+        :return: The database connection.
+        """
+        return psycopg2.connect(dsn, connection_factory=self.connection_factory)
+
+    def record(self, method, seconds, rows, commits=0):
+        """
+        Record a statement or a commit.
+        :param method: Name of the Tournament method.
+        :param seconds: Time the database took.
+        :param rows: Rows returned or changed.
+        :param commits: 1 for a commit, 0 for a statement.
+        :return:
+        """
+        with self.lock:
+            stats = self.stats.get(method)
+            if stats is None:
+                stats = self.stats[method] = [0, 0.0, 0, 0]
+            stats[0] += 1 - commits
+            stats[1] += seconds
+            stats[2] += rows
+            stats[3] += commits
+
+    def slow_query(self, conn, method, seconds, query, vars):
+        """
+        Log a slow statement with its parameters and EXPLAIN plan. The plan
+        is read by a cursor, which is not instrumented, and not read if the
+        transaction has failed.
+        :param conn: The database connection of the statement.
+        :param method: Name of the Tournament method.
+        :param seconds: Time the statement took.
+        :param query: The statement.
+        :param vars: Parameters of the statement.
+        :return:
+        """
+        with self.lock:
+            self.slow_queries += 1
+        plan = ""
+        statement = query.lstrip().lower()
+        if self.explain and statement.startswith(EXPLAINABLE) and \
+                conn.get_transaction_status() != \
+                psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            try:
+                cur.execute("explain " + query, vars)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error as e:
+                plan = "EXPLAIN failed: %s" % e
+            finally:
+                cur.close()
+        log.warning("Slow query in %s, %.1f msec: %s %r\n%s", method,
+                    seconds * 1000, " ".join(query.split()), vars, plan)
+
+    def reset(self):
+        """
+        Clear the statistics.
+        :return:
+        """
+        with self.lock:
+            self.stats.clear()
+            self.slow_queries = 0
+
+    def report(self):
+        """
+        Report the statistics, the method with the most database time first.
+        :return: Report as text.
+        """
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: -item[1][1])
+            lines = ["method, queries, db msec, rows, commits"]
+            for method, (queries, seconds, rows, commits) in stats:
+                lines.append("%s, %d, %.2f, %d, %d" % (
+                    method, queries, seconds * 1000, rows, commits))
+            lines.append("slow queries, %d" % self.slow_queries)
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Statistics in the Prometheus text exposition format.
+        :return: Metrics as text.
+        """
+        metrics = (("tournament_queries_total", "counter",
+                    "Queries executed by Tournament method.", 0),
+                   ("tournament_db_seconds_total", "counter",
+                    "Database time by Tournament method.", 1),
+                   ("tournament_rows_total", "counter",
+                    "Rows returned or changed by Tournament method.", 2),
+                   ("tournament_commits_total", "counter",
+                    "Commits by Tournament method.", 3))
+        lines = []
+        with self.lock:
+            for name, kind, description, index in metrics:
+                lines.append("# HELP %s %s" % (name, description))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for method in sorted(self.stats):
+                    lines.append('%s{method="%s"} %s' % (
+                        name, method, self.stats[method][index]))
+            lines.append("# HELP tournament_slow_queries_total "
+                         "Statements slower than the threshold.")
+            lines.append("# TYPE tournament_slow_queries_total counter")
+            lines.append("tournament_slow_queries_total %d" %
+                         self.slow_queries)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write the statistics for the Prometheus textfile collector. The file
+        is replaced at once, so the collector never reads a partial file.
+        :param path: Path of the file.
+        :return:
+        """
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(self.prometheus())
+        os.rename(temp, path)
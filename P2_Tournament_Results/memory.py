@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+"""
+In-memory tournament module
+memory.py -- Tournament kept in memory for live events. Results, standings
+and pairings are served from memory, and every change is persisted to the
+tournament database by a write-behind queue.
+"""
+
+import logging
+import threading
+import Queue
+from array import array
+
+import pairing
+import tiebreak
+from history import OpponentHistory
+from tournament import Tournament
+
+log = logging.getLogger(__name__)
+
+
+class MemoryTournament(object):
+    """ Tournament kept in memory with write-behind persistence """
+
+    def __init__(self, conn, name):
+        """
+        Constructor of MemoryTournament class. Participants and matches are
+        replayed from the database, so a tournament, which was running when
+        the process stopped, is recovered from what had been persisted.
+        :param conn: The database connection. It is used only by the
+                     write-behind thread after the tournament is loaded.
+        :param name: Name of tournament. If this is new, tournament will be
+                     created.
+        :return:
+        """
+        self.store = Tournament(conn, name)
+        self.t_id = self.store.t_id
+        self.t_name = self.store.t_name
+        self.names = {}
+        self.errors = []
+        self.queue = Queue.Queue()
+        self.points = self.store.scoring()
+        self.__reset_players()
+        self.__load()
+        self.writer = threading.Thread(target=self.__write_behind)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def close(self):
+        """
+        Persist the pending changes, stop the write-behind thread and close
+        the database connection.
+        :return:
+        """
+        self.queue.put(None)
+        self.writer.join()
+        self.store.close()
+
+    def flush(self):
+        """
+        Wait until the pending changes are persisted.
+        :return:
+        """
+        self.queue.join()
+
+    def __enqueue(self, method, *args):
+        """
+        Queue a change to be persisted by the Tournament method of the same
+        name.
+        :param method: Name of the Tournament method.
+        :param args: Arguments of the method.
+        :return:
+        """
+        self.queue.put((method, args))
+
+    def __write_behind(self):
+        """
+        Persist queued changes in order until close() is called. A change,
+        which fails, is rolled back, logged and kept in errors.
+        :return:
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                method, args = item
+                try:
+                    getattr(self.store, method)(*args)
+                except Exception as e:
+                    self.store.conn.rollback()
+                    self.errors.append((method, args, e))
+                    log.exception("Failed to persist %s%r.", method, args)
+            finally:
+                self.queue.task_done()
+
+    def __reset_players(self):
+        """
+        Remove all participants from memory.
+        :return:
+        """
+        self.ids = []
+        self.index = {}
+        self.withdrawn = set()
+        self.__reset_matches()
+
+    def __reset_matches(self):
+        """
+        Remove all results from memory.
+        :return:
+        """
+        size = len(self.ids)
+        self.wins = array("i", [0] * size)
+        self.losses = array("i", [0] * size)
+        self.played = array("i", [0] * size)
+        self.scores = array("i", [0] * size)
+        self.opponent_history = OpponentHistory()
+        self.engine = tiebreak.Tiebreaks(self.points)
+        for p_id in self.ids:
+            self.opponent_history.add_player(p_id)
+            self.engine.add_player(p_id)
+
+    def __load(self):
+        """
+        Replay participants and matches of the tournament from the database.
+        :return:
+        """
+        cur = self.store.cur
+        cur.execute("select participants.p_id, players.name, \
+                     participants.withdrawn from participants join players \
+                     on participants.p_id = players.id where \
+                     participants.t_id = %s;", (self.t_id, ))
+        for p_id, name, withdrawn in cur.fetchall():
+            self.names[p_id] = name
+            self.__add_participant(p_id)
+            if withdrawn:
+                self.withdrawn.add(self.index[p_id])
+        cur.execute("select matches.p_id, opponent.p_id, matches.points, \
+                     opponent.points from matches left join matches as \
+                     opponent on opponent.t_id = matches.t_id and \
+                     opponent.id = matches.id and \
+                     opponent.p_id <> matches.p_id where matches.t_id = %s \
+                     and (opponent.p_id is null or \
+                     matches.p_id < opponent.p_id) order by matches.id;",
+                    (self.t_id, ))
+        rows = cur.fetchall()
+        self.store.conn.rollback()
+        unknown = set(p_id for row in rows for p_id in row[:2]
+                      if p_id is not None and p_id not in self.index)
+        if unknown:
+            raise ValueError("%s do not participate the tournament." %
+                             ", ".join(sorted(unknown)))
+        for p1, p2, points1, points2 in rows:
+            if p2 is None:
+                self.__apply_bye(p1)
+            elif points1 < points2:
+                self.__apply_result(p2, p1, False)
+            else:
+                self.__apply_result(p1, p2, points1 == points2)
+
+    def __add_participant(self, p_id):
+        """
+        Add a participant to memory.
+        :param p_id: Player ID.
+        :return:
+        """
+        self.index[p_id] = len(self.ids)
+        self.ids.append(p_id)
+        for counter in (self.wins, self.losses, self.played, self.scores):
+            counter.append(0)
+        self.opponent_history.add_player(p_id)
+        self.engine.add_player(p_id)
+
+    def __apply_result(self, winner, loser, draw):
+        """
+        Apply a match result to memory.
+        :param winner: Player ID of the winner.
+        :param loser: Player ID of the loser.
+        :param draw: True if the match is a draw.
+        :return:
+        """
+        w, l = self.index[winner], self.index[loser]
+        win, draw_points, loss = self.points[:3]
+        self.played[w] += 1
+        self.played[l] += 1
+        self.opponent_history.add_match(winner, loser)
+        if draw:
+            self.scores[w] += draw_points
+            self.scores[l] += draw_points
+            self.engine.add_result(winner, loser, 0.5)
+        else:
+            self.wins[w] += 1
+            self.losses[l] += 1
+            self.scores[w] += win
+            self.scores[l] += loss
+            self.engine.add_result(winner, loser, 1)
+
+    def __apply_bye(self, p_id):
+        """
+        Apply a bye to memory.
+        :param p_id: Player ID.
+        :return:
+        """
+        i = self.index[p_id]
+        self.wins[i] += 1
+        self.played[i] += 1
+        self.scores[i] += self.points[3]
+        self.opponent_history.add_bye(p_id)
+        self.engine.add_bye(p_id)
+
+    def delete_matches(self):
+        """
+        Delete matches for the tournament.
+        :return:
+        """
+        self.__reset_matches()
+        self.__enqueue("delete_matches")
+
+    def delete_players(self):
+        """
+        Delete players from participants for the tournament. This does not
+        remove players from the registered players of the system.
+        :return:
+        """
+        self.__reset_players()
+        self.__enqueue("delete_players")
+
+    def count_players(self):
+        """
+        Count players, who participate the tournament and have not withdrawn.
+        :return: The number of participants of the tournament.
+        """
+        return len(self.ids) - len(self.withdrawn)
+
+    def register_player(self, p_id, name):
+        """
+        Register a player with the given ID and name.
+        :param p_id: Player ID like email address.
+        :param name: Player's name.
+        :return:
+        """
+        if p_id not in self.names:
+            self.names[p_id] = name
+            self.__enqueue("register_player", p_id, name)
+
+    def register_players(self, rows):
+        """
+        Register players and add them to the tournament.
+        :param rows: Iterable of tuples of (player ID, name).
+        :return: Tuple of the number of participants inserted and the number
+                 of rows skipped.
+        """
+        rows = list(rows)
+        inserted = 0
+        for p_id, name in rows:
+            self.names.setdefault(p_id, name)
+            if p_id not in self.index:
+                self.__add_participant(p_id)
+                inserted += 1
+        self.__enqueue("register_players", rows)
+        return inserted, len(rows) - inserted
+
+    def participate(self, p_id):
+        """
+        Add a player to tournament.
+        :param p_id: Player ID.
+        :return:
+        """
+        if p_id in self.index:
+            raise ValueError("%s already participates the tournament." % p_id)
+        if p_id not in self.names:
+            self.flush()
+            self.store.cur.execute("select name from players where id = %s;",
+                                   (p_id, ))
+            row = self.store.cur.fetchone()
+            self.store.conn.rollback()
+            if row is None:
+                raise ValueError("%s is not registered." % p_id)
+            self.names[p_id] = row[0]
+        self.__add_participant(p_id)
+        self.__enqueue("participate", p_id)
+
+    def scoring(self):
+        """
+        Get the scoring system of the tournament.
+        :return: Tuple of the points for a win, a draw, a loss and a bye.
+        """
+        return self.points
+
+    def set_scoring(self, scoring):
+        """
+        Set the scoring system of the tournament before the first match. See
+        Tournament.set_scoring().
+        :param scoring: Tuple of the points for a win, a draw, a loss and a
+                        bye.
+        :return:
+        """
+        if any(self.played):
+            raise ValueError("Scoring cannot be changed after matches are "
+                             "reported.")
+        self.flush()
+        self.store.set_scoring(scoring)
+        self.points = tuple(scoring)
+        self.__reset_matches()
+
+    def withdraw_player(self, p_id):
+        """
+        Withdraw the player from the rest of the tournament. The results of
+        the player are kept, but the player is left out of the standings and
+        pairings.
+        :param p_id: Player ID.
+        :return:
+        """
+        i = self.index.get(p_id)
+        if i is None or i in self.withdrawn:
+            raise ValueError("%s does not participate the tournament." % p_id)
+        self.withdrawn.add(i)
+        self.__enqueue("withdraw_player", p_id)
+
+    def __order(self):
+        """
+        Indexes of the participants, who have not withdrawn, in standings
+        order, by score and then by the sum of the scores of the opponents
+        like the standings table. Participants have the same numbers in the
+        opponent history as here.
+        :return: List of participant indexes.
+        """
+        scores = self.scores
+        opponents = self.opponent_history.opponent_indexes
+        withdrawn = self.withdrawn
+        players = [i for i in xrange(len(self.ids)) if i not in withdrawn]
+        return sorted(players, reverse=True,
+                      key=lambda i: (scores[i], sum(scores[j]
+                                                    for j in opponents[i])))
+
+    def player_standings(self, tiebreaks=None):
+        """
+        Check the current player standings.
+        :param tiebreaks: Names of the tiebreaks defined in tiebreak module,
+                          which order players with the same score.
+        :return: A list of tuples, each of which contains
+                 (id, name, wins, matches).
+        """
+        standings = [(self.ids[i], self.names[self.ids[i]], self.wins[i],
+                      self.played[i]) for i in self.__order()]
+        if tiebreaks:
+            for name in tiebreaks:
+                if name not in tiebreak.TIEBREAKS:
+                    raise ValueError("Unknown tiebreak, %s." % name)
+            scores, index = self.scores, self.index
+            standings.sort(key=lambda row: (scores[index[row[0]]],
+                                            self.engine.get(row[0],
+                                                            tiebreaks)),
+                           reverse=True)
+        return standings
+
+    def iter_player_standings(self, itersize=2000):
+        """
+        Iterate the current player standings.
+        :param itersize: Not used. Kept for the interface of Tournament.
+        :return: Iterator of the same tuples as player_standings().
+        """
+        return iter(self.player_standings())
+
+    def tiebreaks(self, standings=None):
+        """
+        Get the tiebreak engine of the tournament.
+        :param standings: Not used. Kept for the interface of Tournament.
+        :return: tiebreak.Tiebreaks.
+        """
+        return self.engine
+
+    def history(self, standings=None):
+        """
+        Get the opponent history of the tournament.
+        :param standings: Not used. Kept for the interface of Tournament.
+        :return: history.OpponentHistory.
+        """
+        return self.opponent_history
+
+    def rebuild_standings(self):
+        """
+        Rebuild the standings in the database from the matches table and
+        reload the tournament from it.
+        :return:
+        """
+        self.flush()
+        self.store.rebuild_standings()
+        self.__reset_players()
+        self.__load()
+
+    def report_match(self, winner, loser, draw=False, round=None):
+        """
+        Report the match result.
+        :param winner: Player ID of the user.
+        :param loser: Player ID of the loser.
+        :param draw: True if the match is a draw. Neither player wins.
+        :param round: Round of the match. See Tournament.report_match().
+        :return:
+        """
+        self.report_matches([(winner, loser, draw)], round=round)
+
+    def report_matches(self, results, pairings=None, round=None):
+        """
+        Report a batch of match results.
+        :param results: Iterable of tuples of (winner, loser) or
+                        (winner, loser, draw).
+        :param pairings: Pairings as returned by swiss_pairings(). If given,
+                         each pairing must have exactly one result and the
+                         bye in the pairings, if any, is recorded.
+        :param round: Round of the matches. See Tournament.report_matches().
+        :return: The number of matches reported.
+        """
+        results = [(result[0], result[1],
+                    len(result) > 2 and bool(result[2])) for result in results]
+        if not results:
+            return 0
+        players = set()
+        for winner, loser, draw in results:
+            if winner == loser:
+                raise ValueError("%s cannot play against self." % winner)
+            players.update((winner, loser))
+        unknown = [p_id for p_id in players if p_id not in self.index or
+                   self.index[p_id] in self.withdrawn]
+        if unknown:
+            raise ValueError("%s do not participate the tournament." %
+                             ", ".join(sorted(unknown)))
+        if pairings is not None:
+            pairing.check_pairings(results, pairings)
+        for winner, loser, draw in results:
+            self.__apply_result(winner, loser, draw)
+        if pairings is not None:
+            for entry in pairings:
+                if len(entry) == 2:
+                    self.__apply_bye(entry[0])
+        self.__enqueue("report_matches", results, pairings, round)
+        return len(results)
+
+    def report_bye(self, p_id, round=None):
+        """
+        Report a bye for the player.
+        :param p_id: Player ID.
+        :param round: Round of the bye. See Tournament.report_bye().
+        :return:
+        """
+        i = self.index.get(p_id)
+        if i is None or i in self.withdrawn:
+            raise ValueError("%s does not participate the tournament." % p_id)
+        self.__apply_bye(p_id)
+        self.__enqueue("report_bye", p_id, round)
+
+    def report_round(self, results, pairings=None, round=None):
+        """
+        Report the results of a whole round.
+        :param results: Iterable of tuples of (winner, loser) or
+                        (winner, loser, draw).
+        :param pairings: Pairings of the round. The current swiss_pairings()
+                         if None.
+        :param round: Round number. See Tournament.report_round().
+        :return: The number of matches reported.
+        """
+        if pairings is None:
+            pairings = self.swiss_pairings()
+        return self.report_matches(results, pairings, round)
+
+    def __read(self, method, *args):
+        """
+        Read from the database, after the pending changes are persisted, by
+        the Tournament method of the given name. Rounds are not kept in
+        memory, so the history of rounds is read this way.
+        :param method: Name of the Tournament method.
+        :param args: Arguments of the method.
+        :return: The return value of the method.
+        """
+        self.flush()
+        try:
+            return getattr(self.store, method)(*args)
+        finally:
+            self.store.conn.rollback()
+
+    def current_round(self):
+        """
+        Get the last round, which has a result.
+        :return: The round number, or 0 before the first result.
+        """
+        return self.__read("current_round")
+
+    def player_standings_as_of(self, round):
+        """
+        Check the player standings after the given round.
+        :param round: Round number.
+        :return: A list of tuples of (id, name, wins, matches).
+        """
+        return self.__read("player_standings_as_of", round)
+
+    def round_pairings(self, round):
+        """
+        Get the pairings, which were played in the given round.
+        :param round: Round number.
+        :return: The same tuples as swiss_pairings().
+        """
+        return self.__read("round_pairings", round)
+
+    def swiss_pairings(self):
+        """
+        Pairings for the next round. See Tournament.swiss_pairings().
+        :return: A list of tuples of (id1, name1, id2, name2), and (id, name)
+                 of the player, who gets a bye, with an odd number of players.
+        """
+        ids = self.ids
+        pairs, bye = pairing.swiss_pairings([ids[i] for i in self.__order()],
+                                            self.opponent_history)
+        names = self.names
+        pairings = [(p1, names[p1], p2, names[p2]) for p1, p2 in pairs]
+        if bye is not None:
+            pairings.append((bye, names[bye]))
+        return pairings
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Pairing module
+pairing.py -- Swiss-system pairing engine used by Tournament.swiss_pairings
+"""
+
+from history import OpponentHistory
+
+
+def swiss_pairings(players, history, byes=None, window=32, budget=10000):
+    """
+    Pair players for the next round. Players are paired top-down with the
+    nearest ranked opponent they have not met yet, so pairs stay within a
+    score group unless a player has to float down. When a player cannot be
+    paired, the previous pairs are undone and retried (backtracking). If the
+    budget of backtracking steps runs out, pairings are made by a greedy pass
+    that allows as few rematches as it can.
+    :param players: List of player IDs in standings order, best first.
+    :param history: history.OpponentHistory of the tournament, or a
+                    dictionary of player ID to the set of player IDs the
+                    player has already played.
+    :param byes: Set of player IDs, who already had a bye, when history is a
+                 dictionary. The byes of the OpponentHistory are used
+                 otherwise.
+    :param window: The number of ranks below a player searched for an
+                   opponent.
+    :param budget: The maximum number of backtracking steps.
+    :return: Tuple of the list of pairs of player IDs and the player ID, who
+             gets a bye, or None if the number of players is even.
+    """
+    players = list(players)
+    if not isinstance(history, OpponentHistory):
+        history = OpponentHistory.from_opponents(history, byes or ())
+    if len(players) % 2 == 0:
+        pairs = _pair(players, history, window, budget)
+        if pairs is None:
+            pairs = _greedy_pair(players, history, window)
+        return pairs, None
+
+    # The bye goes to the lowest ranked player without a bye so far.
+    candidates = [p for p in reversed(players) if not history.had_bye(p)] or \
+        list(reversed(players))
+    for bye in candidates[:3]:
+        rest = [p for p in players if p != bye]
+        pairs = _pair(rest, history, window, budget)
+        if pairs is not None:
+            return pairs, bye
+    bye = candidates[0]
+    rest = [p for p in players if p != bye]
+    return _greedy_pair(rest, history, window), bye
+
+
+def check_pairings(results, pairings):
+    """
+    Check that the results match the pairings one to one.
+    :param results: List of tuples of (winner, loser, draw).
+    :param pairings: Pairings as returned by Tournament.swiss_pairings().
+    :return:
+    """
+    expected = set(frozenset((entry[0], entry[2]))
+                   for entry in pairings if len(entry) == 4)
+    for winner, loser, draw in results:
+        pair = frozenset((winner, loser))
+        if pair not in expected:
+            raise ValueError("%s and %s are not paired in this round." %
+                             (winner, loser))
+        expected.remove(pair)
+    if expected:
+        raise ValueError("%d pairings have no result." % len(expected))
+
+
+def _pair(players, history, window, budget):
+    """
+    Pair players without rematches by backtracking.
+    :param players: List of player IDs in standings order. The number of
+                    players must be even.
+    :param history: history.OpponentHistory.
+    :param window: The number of ranks below a player searched.
+    :param budget: The maximum number of backtracking steps.
+    :return: List of pairs of player IDs, or None if pairs without rematches
+             are not found within the budget.
+    """
+    n = len(players)
+    have_met = history.have_met
+    paired = [False] * n
+    stack = []
+    i, k = 0, 1
+    steps = 0
+    while True:
+        while i < n and paired[i]:
+            i += 1
+        if i >= n:
+            return [(players[a], players[b]) for a, b in stack]
+        j = max(k, i + 1)
+        limit = min(n, i + 1 + window)
+        while j < limit and (paired[j] or have_met(players[i], players[j])):
+            j += 1
+        if j < limit:
+            paired[i] = paired[j] = True
+            stack.append((i, j))
+            k = 0
+            continue
+        steps += 1
+        if not stack or steps > budget:
+            return None
+        i, j = stack.pop()
+        paired[i] = paired[j] = False
+        k = j + 1
+
+
+def _greedy_pair(players, history, window):
+    """
+    Pair each player with the nearest ranked opponent not met yet, or the
+    nearest ranked opponent if everyone in the window has been met.
+    :param players: List of player IDs in standings order. The number of
+                    players must be even.
+    :param history: history.OpponentHistory.
+    :param window: The number of unpaired players searched for an opponent.
+    :return: List of pairs of player IDs.
+    """
+    unpaired = list(players)
+    pairs = []
+    while unpaired:
+        player = unpaired.pop(0)
+        index = 0
+        for j, candidate in enumerate(unpaired[:window]):
+            if not history.have_met(player, candidate):
+                index = j
+                break
+        pairs.append((player, unpaired.pop(index)))
+    return pairs
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Rating module
+rating.py -- Elo and Glicko-2 ratings of the players computed from their
+match results. Ratings are kept per player across tournaments. They are
+updated by Tournament.report_match, and recomputed from the whole history of
+matches by running this script, which needs NumPy.
+"""
+
+import argparse
+import math
+import time
+
+ELO = "elo"
+GLICKO2 = "glicko2"
+
+DEFAULT_RATING = 1500.0
+ELO_K = 32.0
+GLICKO_RD = 350.0
+GLICKO_VOLATILITY = 0.06
+# System constant of Glicko-2, which limits the change of the volatility.
+GLICKO_TAU = 0.5
+# Ratings are converted to the Glicko-2 scale by this factor.
+GLICKO_SCALE = 173.7178
+GLICKO_EPSILON = 0.000001
+
+
+def elo_update(rating1, rating2, score, k=ELO_K):
+    """
+    Update the Elo ratings of two players after their match.
+    :param rating1: Elo rating of the first player.
+    :param rating2: Elo rating of the second player.
+    :param score: Score of the first player, 1 for a win, 0.5 for a draw and
+                  0 for a loss.
+    :param k: K-factor, the maximum change of a rating.
+    :return: Tuple of the new ratings of both players.
+    """
+    expected = 1 / (1 + 10 ** ((rating2 - rating1) / 400.0))
+    change = k * (score - expected)
+    return rating1 + change, rating2 - change
+
+
+def _volatility(phi, sigma, v, delta):
+    """
+    New volatility of a player by the Illinois algorithm of Glicko-2.
+    :param phi: Rating deviation on the Glicko-2 scale.
+    :param sigma: Volatility.
+    :param v: Estimated variance of the rating from the match.
+    :param delta: Estimated improvement of the rating from the match.
+    :return: The new volatility.
+    """
+    # ln(sigma^2) is a constant of f. The bracket [A, B] around the root is
+    # kept apart from it, so that f does not change during the search.
+    a0 = math.log(sigma ** 2)
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / \
+            (2 * (phi ** 2 + v + ex) ** 2) - (x - a0) / GLICKO_TAU ** 2
+
+    A = a0
+    if delta ** 2 > phi ** 2 + v:
+        B = math.log(delta ** 2 - phi ** 2 - v)
+    else:
+        k = 1
+        while f(a0 - k * GLICKO_TAU) < 0:
+            k += 1
+        B = a0 - k * GLICKO_TAU
+    fA, fB = f(A), f(B)
+    while abs(B - A) > GLICKO_EPSILON:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB < 0:
+            A, fA = B, fB
+        else:
+            fA /= 2
+        B, fB = C, fC
+    return math.exp(A / 2)
+
+
+def glicko2_update(player, opponent, score):
+    """
+    Update the Glicko-2 rating of a player after a match, which is treated
+    as a rating period of its own.
+    :param player: Tuple of rating, rating deviation and volatility.
+    :param opponent: Tuple of rating, rating deviation and volatility of the
+                     opponent before the match.
+    :param score: Score of the player, 1 for a win, 0.5 for a draw and 0 for
+                  a loss.
+    :return: Tuple of the new rating, rating deviation and volatility.
+    """
+    mu = (player[0] - DEFAULT_RATING) / GLICKO_SCALE
+    phi = player[1] / GLICKO_SCALE
+    sigma = player[2]
+    mu_j = (opponent[0] - DEFAULT_RATING) / GLICKO_SCALE
+    phi_j = opponent[1] / GLICKO_SCALE
+    g = 1 / math.sqrt(1 + 3 * phi_j ** 2 / math.pi ** 2)
+    expected = 1 / (1 + math.exp(-g * (mu - mu_j)))
+    v = 1 / (g ** 2 * expected * (1 - expected))
+    delta = v * g * (score - expected)
+    sigma = _volatility(phi, sigma, v, delta)
+    phi = 1 / math.sqrt(1 / (phi ** 2 + sigma ** 2) + 1 / v)
+    mu += phi ** 2 * g * (score - expected)
+    return (mu * GLICKO_SCALE + DEFAULT_RATING, phi * GLICKO_SCALE, sigma)
+
+
+class Ratings(object):
+    """ Elo and Glicko-2 ratings of players updated match by match """
+
+    def __init__(self, rows=()):
+        """
+        Constructor of Ratings class.
+        :param rows: Rows of the ratings table, which are tuples of (player
+                     ID, elo, glicko, glicko_rd, glicko_volatility, matches).
+        :return:
+        """
+        self.players = {}
+        for row in rows:
+            self.players[row[0]] = list(row[1:])
+
+    def get(self, p_id):
+        """
+        Get the ratings of the player. A player without matches has the
+        default ratings.
+        :param p_id: Player ID.
+        :return: List of elo, glicko, glicko_rd, glicko_volatility and the
+                 number of rated matches.
+        """
+        ratings = self.players.get(p_id)
+        if ratings is None:
+            ratings = self.players[p_id] = [DEFAULT_RATING, DEFAULT_RATING,
+                                            GLICKO_RD, GLICKO_VOLATILITY, 0]
+        return ratings
+
+    def add_result(self, p1, p2, score):
+        """
+        Update the ratings of both players after their match.
+        :param p1: Player ID of the first player.
+        :param p2: Player ID of the second player.
+        :param score: Score of the first player, 1 for a win, 0.5 for a draw
+                      and 0 for a loss.
+        :return:
+        """
+        r1, r2 = self.get(p1), self.get(p2)
+        r1[0], r2[0] = elo_update(r1[0], r2[0], score)
+        g1, g2 = tuple(r1[1:4]), tuple(r2[1:4])
+        r1[1:4] = glicko2_update(g1, g2, score)
+        r2[1:4] = glicko2_update(g2, g1, 1 - score)
+        r1[4] += 1
+        r2[4] += 1
+
+    def rows(self):
+        """
+        Rows for the ratings table.
+        :return: List of tuples of (player ID, elo, glicko, glicko_rd,
+                 glicko_volatility, matches).
+        """
+        return [tuple([p_id] + ratings)
+                for p_id, ratings in self.players.iteritems()]
+
+
+def _save(cur, rows):
+    """
+    Write ratings with a single statement. This does not commit.
+    :param cur: Cursor of the tournament database.
+    :param rows: List of tuples of (player ID, elo, glicko, glicko_rd,
+                 glicko_volatility, matches).
+    :return:
+    """
+    cur.execute("insert into ratings (p_id, elo, glicko, glicko_rd, \
+                 glicko_volatility, matches) select * from \
+                 unnest(%s::text[], %s::float8[], %s::float8[], \
+                 %s::float8[], %s::float8[], %s::integer[]) on conflict \
+                 (p_id) do update set elo = excluded.elo, \
+                 glicko = excluded.glicko, glicko_rd = excluded.glicko_rd, \
+                 glicko_volatility = excluded.glicko_volatility, \
+                 matches = excluded.matches;",
+                [list(column) for column in zip(*rows)])
+
+
+def update_ratings(cur, results):
+    """
+    Update the ratings of the players of the given results in the order of
+    the results. The rows of the players are locked in the order of player
+    IDs, so that tournaments reporting the same players do not deadlock.
+    This does not commit, so it runs in the same transaction as the results.
+    :param cur: Cursor of the tournament database.
+    :param results: List of tuples of (winner, loser, draw).
+    :return:
+    """
+    if not results:
+        return
+    players = sorted(set(p_id for winner, loser, draw in results
+                         for p_id in (winner, loser)))
+    cur.execute("insert into ratings (p_id) select * from \
+                 unnest(%s::text[]) on conflict (p_id) do nothing;",
+                (players, ))
+    cur.execute("select p_id, elo, glicko, glicko_rd, glicko_volatility, \
+                 matches from ratings where p_id = any(%s) order by p_id \
+                 for update;", (players, ))
+    ratings = Ratings(cur.fetchall())
+    for winner, loser, draw in results:
+        ratings.add_result(winner, loser, 0.5 if draw else 1)
+    _save(cur, ratings.rows())
+
+
+def levels(first, second, size):
+    """
+    Split matches into levels, which are updated at once. The level of a
+    match is one more than the levels of the previous matches of both
+    players, so no player plays twice in a level, and updating the levels in
+    order gives the same ratings as updating the matches one by one.
+    :param first: List of the numbers of the first players of the matches.
+    :param second: List of the numbers of the second players.
+    :param size: The number of players.
+    :return: List of the levels of the matches, starting at 0.
+    """
+    last = [0] * size
+    result = []
+    for i, j in zip(first, second):
+        level = max(last[i], last[j])
+        result.append(level)
+        last[i] = last[j] = level + 1
+    return result
+
+
+def _glicko2_arrays(np, mu, phi, sigma, mu_j, phi_j, score):
+    """
+    glicko2_update for arrays of players on the Glicko-2 scale.
+    :param np: numpy module.
+    :param mu: Ratings of the players.
+    :param phi: Rating deviations of the players.
+    :param sigma: Volatilities of the players.
+    :param mu_j: Ratings of the opponents.
+    :param phi_j: Rating deviations of the opponents.
+    :param score: Scores of the players.
+    :return: Tuple of arrays of the new mu, phi and sigma.
+    """
+    g = 1 / np.sqrt(1 + 3 * phi_j ** 2 / math.pi ** 2)
+    expected = 1 / (1 + np.exp(-g * (mu - mu_j)))
+    v = 1 / (g ** 2 * expected * (1 - expected))
+    delta = v * g * (score - expected)
+    phi2, delta2 = phi ** 2, delta ** 2
+    # ln(sigma^2) is a constant of f, apart from the bracket [A, B].
+    a0 = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta2 - phi2 - v - ex) / \
+            (2 * (phi2 + v + ex) ** 2) - (x - a0) / GLICKO_TAU ** 2
+
+    large = delta2 > phi2 + v
+    A = a0
+    B = np.where(large, np.log(np.where(large, delta2 - phi2 - v, 1)),
+                 a0 - GLICKO_TAU)
+    below = ~large & (f(B) < 0)
+    while below.any():
+        B[below] -= GLICKO_TAU
+        below &= f(B) < 0
+    fA, fB = f(A), f(B)
+    active = np.abs(B - A) > GLICKO_EPSILON
+    with np.errstate(divide="ignore", invalid="ignore"):
+        while active.any():
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            swap = active & (fC * fB < 0)
+            keep = active & ~swap
+            A = np.where(swap, B, A)
+            fA = np.where(swap, fB, np.where(keep, fA / 2, fA))
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+            active &= np.abs(B - A) > GLICKO_EPSILON
+    sigma = np.exp(A / 2)
+    phi = 1 / np.sqrt(1 / (phi2 + sigma ** 2) + 1 / v)
+    return mu + phi ** 2 * g * (score - expected), phi, sigma
+
+
+def bulk_ratings(first, second, scores, size):
+    """
+    Compute the ratings of all players from their matches in order with
+    NumPy. The matches of a level are updated at once with array operations.
+    :param first: Sequence of the numbers of the first players.
+    :param second: Sequence of the numbers of the second players.
+    :param scores: Sequence of the scores of the first players.
+    :param size: The number of players.
+    :return: Tuple of arrays of elo, glicko, glicko_rd, glicko_volatility
+             and the number of matches, indexed by player number.
+    """
+    import numpy as np
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    elo = np.full(size, DEFAULT_RATING)
+    mu = np.zeros(size)
+    phi = np.full(size, GLICKO_RD / GLICKO_SCALE)
+    sigma = np.full(size, GLICKO_VOLATILITY)
+    matches = np.bincount(first, minlength=size) + \
+        np.bincount(second, minlength=size)
+    match_levels = np.asarray(levels(first.tolist(), second.tolist(), size),
+                              dtype=np.int64)
+    order = np.argsort(match_levels, kind="mergesort")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(match_levels))))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        level = order[start:end]
+        i, j, s = first[level], second[level], scores[level]
+        expected = 1 / (1 + 10 ** ((elo[j] - elo[i]) / 400.0))
+        change = ELO_K * (s - expected)
+        elo[i] += change
+        elo[j] -= change
+        mu_i, phi_i, sigma_i = mu[i], phi[i], sigma[i]
+        mu_j, phi_j, sigma_j = mu[j], phi[j], sigma[j]
+        mu[i], phi[i], sigma[i] = _glicko2_arrays(np, mu_i, phi_i, sigma_i,
+                                                   mu_j, phi_j, s)
+        mu[j], phi[j], sigma[j] = _glicko2_arrays(np, mu_j, phi_j, sigma_j,
+                                                   mu_i, phi_i, 1 - s)
+    return (elo, mu * GLICKO_SCALE + DEFAULT_RATING, phi * GLICKO_SCALE,
+            sigma, matches)
+
+
+def recompute_ratings(conn):
+    """
+    Recompute the ratings of all players from every match in the order the
+    matches were reported, and replace the ratings table in one transaction.
+    Byes do not change ratings.
+    :param conn: The database connection.
+    :return: The number of matches rated.
+    """
+    cur = conn.cursor()
+    cur.execute("lock table ratings in exclusive mode;")
+    cur.execute("select matches.p_id, opponent.p_id, matches.points, \
+                 opponent.points from matches join matches as opponent on \
+                 opponent.t_id = matches.t_id and opponent.id = matches.id \
+                 and matches.p_id < opponent.p_id order by matches.id;")
+    index = {}
+    ids, first, second, scores = [], [], [], []
+    for p1, p2, points1, points2 in cur:
+        for p_id in (p1, p2):
+            if p_id not in index:
+                index[p_id] = len(ids)
+                ids.append(p_id)
+        first.append(index[p1])
+        second.append(index[p2])
+        if points1 > points2:
+            scores.append(1.0)
+        elif points1 == points2:
+            scores.append(0.5)
+        else:
+            scores.append(0.0)
+    columns = bulk_ratings(first, second, scores, len(ids))
+    cur.execute("delete from ratings;")
+    if ids:
+        _save(cur, zip(ids, *[column.tolist() for column in columns]))
+    conn.commit()
+    cur.close()
+    return len(first)
+
+
+def main():
+    from tournament import connect
+    parser = argparse.ArgumentParser(
+        description="Recompute Elo and Glicko-2 ratings from all matches.")
+    parser.parse_args()
+    start = time.time()
+    conn = connect()
+    count = recompute_ratings(conn)
+    conn.close()
+    print "%d matches rated in %.2f sec." % (count, time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
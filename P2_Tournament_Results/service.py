@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Tournament service module
+service.py -- host many tournaments in one process. Each tournament is
+served by one thread at a time, connections come from a bounded pool, and
+work can be submitted to worker threads, which return futures.
+"""
+
+import contextlib
+import logging
+import threading
+import Queue
+
+import psycopg2.pool
+
+from tournament import DSN, Tournament
+
+log = logging.getLogger(__name__)
+
+
+class Future(object):
+    """ Result of work submitted to TournamentService """
+
+    def __init__(self):
+        """
+        Constructor of Future class.
+        :return:
+        """
+        self.__done = threading.Event()
+        self.__result = None
+        self.__error = None
+
+    def done(self):
+        """
+        Check whether the work has finished.
+        :return: True if the work has finished.
+        """
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the work and get its result.
+        :param timeout: Seconds to wait. Wait forever if None.
+        :return: The return value of the work. If the work raised an
+                 exception, it is raised again.
+        """
+        if not self.__done.wait(timeout):
+            raise RuntimeError("The work has not finished in %s seconds." %
+                               timeout)
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+    def set_result(self, result):
+        """
+        Set the result of the work.
+        :param result: The return value of the work.
+        :return:
+        """
+        self.__result = result
+        self.__done.set()
+
+    def set_error(self, error):
+        """
+        Set the exception raised by the work.
+        :param error: The exception.
+        :return:
+        """
+        self.__error = error
+        self.__done.set()
+
+
+class TournamentService(object):
+    """ Host of many tournaments with bounded database connections """
+
+    def __init__(self, maxconn=10, workers=None, dsn=DSN, cache=None):
+        """
+        Constructor of TournamentService class.
+        :param maxconn: The maximum number of database connections. Threads
+                        wait for a connection when all of them are in use.
+        :param workers: The number of worker threads of submit(). Same as
+                        maxconn if None.
+        :param dsn: Connection string of the tournament database.
+        :param cache: cache.StandingsCache shared by the tournaments.
+                      Tournament.cache if None.
+        :return:
+        """
+        self.cache = cache
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, maxconn, dsn)
+        self.connections = threading.BoundedSemaphore(maxconn)
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.tournaments = {}
+        self.queue = Queue.Queue()
+        self.workers = []
+        for i in xrange(workers or maxconn):
+            worker = threading.Thread(target=self.__work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def close(self):
+        """
+        Finish the submitted work, stop the workers and close the
+        connections.
+        :return:
+        """
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.pool.closeall()
+
+    def __lock(self, name):
+        """
+        Get the lock of the tournament.
+        :param name: Name of tournament.
+        :return: threading.RLock.
+        """
+        with self.lock:
+            lock = self.locks.get(name)
+            if lock is None:
+                lock = self.locks[name] = threading.RLock()
+            return lock
+
+    @contextlib.contextmanager
+    def tournament(self, name):
+        """
+        Context manager of the Tournament handle of the given tournament.
+        The handle is kept between uses, so its caches survive, and gets a
+        pooled connection for the duration of the block. Other threads wait
+        until the block exits to use the same tournament.
+        :param name: Name of tournament. If this is new, tournament will be
+                     created.
+        """
+        with self.__lock(name):
+            self.connections.acquire()
+            try:
+                conn = self.pool.getconn()
+                tournament = self.tournaments.get(name)
+                try:
+                    if tournament is None:
+                        tournament = Tournament(conn, name, self.cache)
+                        self.tournaments[name] = tournament
+                    else:
+                        tournament.attach(conn)
+                    yield tournament
+                finally:
+                    if tournament is not None and tournament.conn is conn:
+                        tournament.detach()
+                    else:
+                        conn.rollback()
+                    self.pool.putconn(conn)
+            finally:
+                self.connections.release()
+
+    def call(self, name, function, *args):
+        """
+        Call the function with the Tournament handle of the tournament in the
+        calling thread.
+        :param name: Name of tournament.
+        :param function: Function, which takes Tournament and args, like
+                         Tournament.report_match.
+        :param args: Arguments of the function.
+        :return: The return value of the function.
+        """
+        with self.tournament(name) as tournament:
+            return function(tournament, *args)
+
+    def submit(self, name, function, *args):
+        """
+        Submit a call() to the worker threads. Work submitted for the same
+        tournament never runs at the same time, but it is not ordered, so
+        steps which depend on each other belong in one function.
+        :param name: Name of tournament.
+        :param function: Function, which takes Tournament and args.
+        :param args: Arguments of the function.
+        :return: Future of the return value.
+        """
+        future = Future()
+        self.queue.put((future, name, function, args))
+        return future
+
+    def __work(self):
+        """
+        Run submitted work until close() is called.
+        :return:
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, name, function, args = item
+            try:
+                future.set_result(self.call(name, function, *args))
+            except Exception as e:
+                log.exception("Work on %s failed.", name)
+                future.set_error(e)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Tiebreak module
+tiebreak.py -- tiebreak scores for the standings of a Swiss-system tournament
+"""
+
+BUCHHOLZ = "buchholz"
+MEDIAN_BUCHHOLZ = "median_buchholz"
+SONNEBORN_BERGER = "sonneborn_berger"
+OMW = "omw"
+
+TIEBREAKS = (BUCHHOLZ, MEDIAN_BUCHHOLZ, SONNEBORN_BERGER, OMW)
+
+# Opponents' match-win percentage is floored at one third, so that losing to
+# a player, who dropped out early, is not punished too much.
+OMW_FLOOR = 1.0 / 3
+
+# Points for a win, a draw, a loss and a bye of the classic tiebreaks, which
+# count a draw as half a win.
+CLASSIC = (1, 0.5, 0, 1)
+
+
+class Tiebreaks(object):
+    """ Tiebreak scores of the players computed from their match results. """
+
+    def __init__(self, scoring=CLASSIC):
+        """
+        Constructor of Tiebreaks class.
+        :param scoring: Tuple of the points for a win, a draw, a loss and a
+                        bye, like the scoring system of the tournament, so
+                        that the tiebreaks agree with the score order.
+        :return:
+        """
+        self.scoring = tuple(scoring)
+        self.games = {}
+        self.score = {}
+        self.played = {}
+        self.values = {}
+        self.dirty = set()
+
+    def add_player(self, p_id):
+        """
+        Add a player without results.
+        :param p_id: Player ID.
+        :return:
+        """
+        if p_id not in self.games:
+            self.games[p_id] = []
+            self.score[p_id] = 0.0
+            self.played[p_id] = 0
+            self.dirty.add(p_id)
+
+    def add_result(self, p1, p2, result):
+        """
+        Add the result of a match. The tiebreaks of both players and of
+        everyone, who played them, have to be recomputed.
+        :param p1: Player ID of the first player.
+        :param p2: Player ID of the second player.
+        :param result: Result of the first player, 1 for a win, 0.5 for a
+                       draw and 0 for a loss.
+        :return:
+        """
+        win, draw, loss = self.scoring[:3]
+        if result == 1:
+            points1, points2 = win, loss
+        elif result == 0:
+            points1, points2 = loss, win
+        else:
+            points1 = points2 = draw
+        self.add_player(p1)
+        self.add_player(p2)
+        self.games[p1].append((p2, points1))
+        self.games[p2].append((p1, points2))
+        for p_id, points in ((p1, points1), (p2, points2)):
+            self.score[p_id] += points
+            self.played[p_id] += 1
+            self.__invalidate(p_id)
+
+    def add_bye(self, p_id):
+        """
+        Add a bye, which counts as a match without opponent worth the bye
+        points.
+        :param p_id: Player ID.
+        :return:
+        """
+        self.add_player(p_id)
+        self.score[p_id] += self.scoring[3]
+        self.played[p_id] += 1
+        self.__invalidate(p_id)
+
+    def __invalidate(self, p_id):
+        """
+        Mark the player and the opponents of the player to be recomputed.
+        :param p_id: Player ID, whose score has changed.
+        :return:
+        """
+        self.dirty.add(p_id)
+        for opponent, points in self.games[p_id]:
+            self.dirty.add(opponent)
+
+    def __win_rate(self, p_id):
+        """
+        Match-win percentage of the player, the share of the points of
+        winning every match, floored at OMW_FLOOR.
+        :param p_id: Player ID.
+        :return: Match-win percentage between OMW_FLOOR and 1.
+        """
+        if not self.played[p_id]:
+            return OMW_FLOOR
+        return max(OMW_FLOOR, float(self.score[p_id]) /
+                   (self.played[p_id] * self.scoring[0]))
+
+    def compute(self):
+        """
+        Recompute the tiebreaks of the players, whose opponents' results have
+        changed since the last call, in one pass over their matches.
+        :return:
+        """
+        score = self.score
+        win = float(self.scoring[0])
+        for p_id in self.dirty:
+            games = self.games[p_id]
+            opponents = [score[opponent] for opponent, points in games]
+            buchholz = sum(opponents)
+            if len(opponents) > 2:
+                median = buchholz - max(opponents) - min(opponents)
+            else:
+                median = buchholz
+            # Scores of the opponents weighted by the share of a win earned
+            # against them.
+            berger = sum(score[opponent] * points / win
+                         for opponent, points in games)
+            if games:
+                omw = sum(self.__win_rate(opponent)
+                          for opponent, points in games) / len(games)
+            else:
+                omw = 0.0
+            self.values[p_id] = {BUCHHOLZ: buchholz,
+                                 MEDIAN_BUCHHOLZ: median,
+                                 SONNEBORN_BERGER: berger,
+                                 OMW: omw}
+        self.dirty.clear()
+
+    def get(self, p_id, tiebreaks=TIEBREAKS):
+        """
+        Get tiebreak values of the player.
+        :param p_id: Player ID.
+        :param tiebreaks: Names of the tiebreaks in order.
+        :return: Tuple of the tiebreak values.
+        """
+        if self.dirty:
+            self.compute()
+        values = self.values.get(p_id)
+        if values is None:
+            return tuple(0 for name in tiebreaks)
+        return tuple(values[name] for name in tiebreaks)
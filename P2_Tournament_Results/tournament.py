@@ -4,7 +4,67 @@ Tournament module
 tournament.py -- implementation of a Swiss-system tournament
 """
 
+import contextlib
+import hashlib
+import re
+import threading
+import weakref
+
 import psycopg2
+import psycopg2.pool
+
+import pairing
+import rating
+import tiebreak
+from history import OpponentHistory
+
+DSN = "dbname=tournament"
+
+# Scoring systems as tuples of the points for a win, a draw, a loss and a bye.
+# Points are integers, so chess scoring counts half points.
+WINS = (1, 0, 0, 1)
+CHESS = (2, 1, 0, 2)
+FOOTBALL = (3, 1, 0, 3)
+
+# Statements, which can be prepared.
+PREPARABLE = ("select", "insert", "update", "delete", "with")
+
+# Tournament IDs by the connection string of the database and the name.
+# Tournaments are never deleted, so a handle of a known tournament is
+# constructed without a query. Handles on different databases do not share
+# IDs, and forget_tournament_ids() clears them after a schema is recreated.
+_tournament_ids = {}
+
+# Names of the statements prepared on each connection. Prepared statements
+# live as long as the database session, so they are kept per connection.
+_prepared = weakref.WeakKeyDictionary()
+
+# Tuples of the statement name and the PREPARE statement by query.
+_statements = {}
+
+
+def _prepare(query):
+    """
+    Make the PREPARE statement of a query. The %s placeholders of the query
+    become the numbered parameters of the prepared statement, which is named
+    after the query, so that the name is the same on every connection.
+    :param query: Query with %s placeholders.
+    :return: Tuple of the statement name and the PREPARE statement.
+    """
+    statement = _statements.get(query)
+    if statement is None:
+        count = [0]
+
+        def parameter(match):
+            if match.group() == "%%":
+                return "%"
+            count[0] += 1
+            return "$%d" % count[0]
+        name = "tournament_" + hashlib.md5(query).hexdigest()[:16]
+        statement = (name, "prepare %s as %s" % (
+            name, re.sub("%%|%s", parameter, " ".join(query.split()))))
+        _statements[query] = statement
+    return statement
 
 
 class Tournament(object):
@@ -12,100 +72,265 @@ class Tournament(object):
 
     default = "__DEFAULT__"
 
-    def __init__(self, conn, name):
+    # cache.StandingsCache shared by the tournaments, which are not given
+    # their own. Standings and pairings are not cached if None.
+    cache = None
+
+    # Ratings of the players are updated with every reported match if True.
+    rated = True
+
+    # Queries are run as prepared statements, which are prepared once per
+    # connection, if True. Set it False behind a pooler like PgBouncer in
+    # transaction mode, where the session of a connection changes.
+    prepare = True
+
+    def __init__(self, conn, name, cache=None):
         """
         Constructor of Tournament class.
         :param conn: The database connection.
         :param name: Name of tournament. If this is new, tournament will be
                      created.
+        :param cache: cache.StandingsCache for the standings and pairings of
+                      the tournament. Tournament.cache if None.
         :return:
         """
-        self.conn = conn
-        self.cur = self.conn.cursor()
+        # Incremented by attach(), so that a snapshot can tell whether its
+        # connection is still attached for the same call.
+        self.__attachments = 0
+        self.attach(conn)
         self.t_id = None
         self.t_name = name
+        if cache is not None:
+            self.cache = cache
+        self.__tiebreaks = None
+        self.__history = None
         self.__get_tournament(name)
-        self.__create_player_standings()
 
     def close(self):
         """
         close cursor and connection.
         :return:
         """
-        # self.cur.execute("drop view standings_%s;", (self.t_id, ))
         self.cur.close()
         self.conn.close()
 
-    def __create_tournament(self, name):
+    def attach(self, conn):
         """
-        Create a new tournament with the given name.
-        :param name: Name of the new tournament.
+        Use the given connection, like one checked out of a pool, for the
+        following operations.
+        :param conn: The database connection.
         :return:
         """
-        self.cur.execute("insert into tournaments (name) values(%s);",
-                         (name,))
-        self.cur.execute("commit;")
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.__attachments += 1
 
-    def __create_player_standings(self):
+    def detach(self):
+        """
+        Stop using the connection, so that it can be returned to a pool. An
+        open transaction is rolled back.
+        :return: The database connection.
         """
-        Create player standings view of the tournament.
+        conn = self.conn
+        self.cur.close()
+        if not conn.closed:
+            conn.rollback()
+        self.conn = None
+        self.cur = None
+        return conn
+
+    def __execute(self, query, vars=(), cur=None):
+        """
+        Execute a query as a prepared statement, which is prepared on the
+        first use on the connection, so that the server parses and plans it
+        once per session. Statements, which cannot be prepared, and queries
+        on a named cursor are executed as they are.
+        :param query: Query with %s placeholders.
+        :param vars: Parameters of the query.
+        :param cur: Cursor to execute the query on. self.cur if None.
         :return:
         """
-        self.cur.execute("create or replace view standings_%s as select \
-                          participants.t_id, participants.p_id, sum(points) \
-                          from participants left join matches on \
-                          participants.p_id = matches.p_id where \
-                          participants.t_id = %s group by participants.t_id, \
-                          participants.p_id;", (self.t_id, self.t_id))
+        if cur is None:
+            cur = self.cur
+        if not self.prepare or cur.name is not None or \
+                not query.lstrip().lower().startswith(PREPARABLE):
+            cur.execute(query, vars)
+            return
+        name, statement = _prepare(query)
+        prepared = _prepared.get(cur.connection)
+        if prepared is None:
+            with _lock:
+                prepared = _prepared.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(statement)
+            prepared.add(name)
+        if vars:
+            cur.execute("execute %s (%s);" % (
+                name, ", ".join(["%s"] * len(vars))), vars)
+        else:
+            cur.execute("execute %s;" % name)
 
     def __get_tournament(self, name):
         """
-        Get tournament ID for the given tournament.
+        Get tournament ID for the given tournament, and create the tournament
+        if it is new. The ID is cached for the process, so only the first
+        handle of a tournament queries the database, with a single statement.
         :param name: Tournament name.
         :return: Tuple of tournament ID and tournament name.
         """
-        if self.t_id:
-            pass
-        else:
-            self.cur.execute("select * from tournaments where name = %s;",
-                             (name, ))
-            if self.cur.rowcount <= 0:
-                self.__create_tournament(name)
-            self.cur.execute("select * from tournaments where name = %s;",
-                             (name, ))
+        key = (self.conn.dsn, name)
+        t_id = _tournament_ids.get(key)
+        while t_id is None:
+            # The select does not see a row inserted by the same statement,
+            # and a concurrent insert committed after the statement started
+            # is seen on the next try.
+            self.__execute("with created as (insert into tournaments (name) \
+                            values (%s) on conflict (name) do nothing \
+                            returning id) select id from created union all \
+                            select id from tournaments where name = %s;",
+                           (name, name))
             row = self.cur.fetchone()
-            self.t_id = row[0]
-            self.t_name = row[1]
+            self.conn.commit()
+            if row is not None:
+                t_id = _tournament_ids[key] = row[0]
+        self.t_id = t_id
         return self.t_id, self.t_name
 
+    def __bump_version(self, reset=False):
+        """
+        Increment the result version of the tournament, so that the cached
+        standings and pairings of the older versions are not used any more.
+        This is the first change of every transaction, which changes results
+        or participants, so the row lock of the tournament serializes them
+        and the changed standings rows are stamped with the new version.
+        This does not commit, so the new version is visible together with
+        the change.
+        :param reset: True if standings rows are deleted or withdrawn, so
+                      that changes since an older version cannot be told row
+                      by row.
+        :return:
+        """
+        if reset:
+            self.__execute("update tournaments set version = version + 1, \
+                            reset_version = version + 1 where id = %s;",
+                           (self.t_id, ))
+        else:
+            self.__execute("update tournaments set version = version + 1 \
+                            where id = %s;", (self.t_id, ))
+
+    def version(self):
+        """
+        Get the result version of the tournament. It is incremented in the
+        same transaction as every change of results or participants.
+        :return: The result version.
+        """
+        self.__execute("select version from tournaments where id = %s;",
+                       (self.t_id, ))
+        return self.cur.fetchone()[0]
+
+    def __cached(self, kind, query, *args):
+        """
+        Get a snapshot from the cache, or build and cache it. The version is
+        read again after the snapshot is built, and the snapshot is cached
+        only if no change was committed in between.
+        :param kind: Kind of the snapshot like "standings".
+        :param query: Function, which builds the snapshot.
+        :param args: Other arguments, which the snapshot depends on.
+        :return: The snapshot.
+        """
+        cache = self.cache
+        if cache is None:
+            return query()
+        version = self.version()
+        key = cache.key(kind, self.t_id, version, *args)
+        value = cache.get(key)
+        if value is None:
+            value = query()
+            if self.version() == version:
+                cache.set(key, value)
+        return value
+
     def delete_matches(self):
         """
         Delete matches for the tournament.
         :return:
         """
-        self.cur.execute("delete from matches where t_id = %s;",
-                         (self.t_id, ))
-        self.cur.execute("commit;")
+        self.__bump_version()
+        self.__execute("delete from matches where t_id = %s;",
+                       (self.t_id, ))
+        self.__execute("update standings set wins = 0, losses = 0, \
+                        matches = 0, score = 0, opponents = '{}', \
+                        tiebreak = 0, byes = 0, version = (select version \
+                        from tournaments where id = %s) \
+                        where t_id = %s;", (self.t_id, self.t_id))
+        self.conn.commit()
+        self.__tiebreaks = None
+        self.__history = None
 
     def delete_players(self):
         """
         Delete players from participants for the tournament. This does not
-        remove players from the registered players of the system.
+        remove players from the registered players of the system. Their
+        standings are removed by the cascade on participants.
         :return:
         """
-        self.cur.execute("delete from participants where t_id = %s;",
-                         (self.t_id, ))
-        self.cur.execute("commit;")
+        self.__bump_version(reset=True)
+        self.__execute("delete from participants where t_id = %s;",
+                       (self.t_id, ))
+        self.conn.commit()
+        self.__tiebreaks = None
+        self.__history = None
+
+    def scoring(self):
+        """
+        Get the scoring system of the tournament.
+        :return: Tuple of the points for a win, a draw, a loss and a bye.
+        """
+        self.__execute("select win_points, draw_points, loss_points, \
+                        bye_points from tournaments where id = %s;",
+                       (self.t_id, ))
+        return self.cur.fetchone()
+
+    def set_scoring(self, scoring):
+        """
+        Set the scoring system of the tournament, like FOOTBALL. Matches
+        store the points they were worth, so the scoring can be set only
+        before the first match is reported.
+        :param scoring: Tuple of the points for a win, a draw, a loss and a
+                        bye.
+        :return:
+        """
+        win, draw, loss, bye = scoring
+        for points in scoring:
+            if not isinstance(points, (int, long)) or \
+                    not 0 <= points <= 32767:
+                raise ValueError("Points must be integers from 0 to 32767.")
+        if not loss <= draw <= win or loss == win:
+            raise ValueError("A win must be worth more than a loss, and a "
+                             "draw between them.")
+        self.__bump_version()
+        self.__execute("update tournaments set win_points = %s, \
+                        draw_points = %s, loss_points = %s, bye_points = %s \
+                        where id = %s and not exists (select 1 from matches \
+                        where t_id = %s);",
+                       (win, draw, loss, bye, self.t_id, self.t_id))
+        if self.cur.rowcount <= 0:
+            self.conn.rollback()
+            raise ValueError("Scoring cannot be changed after matches are "
+                             "reported.")
+        self.conn.commit()
+        self.__history = None
+        self.__tiebreaks = None
 
 
     def count_players(self):
         """
-        Count players, who participate the tournament.
+        Count players, who participate the tournament and have not withdrawn.
         :return: The number of participants of the tournament.
         """
-        self.cur.execute("select count(p_id) from participants where \
-                          t_id = %s;",
-                         (self.t_id, ))
+        self.__execute("select count(p_id) from participants where \
+                        t_id = %s and not withdrawn;",
+                       (self.t_id, ))
         return self.cur.fetchone()[0]
 
     def register_player(self, p_id, name):
@@ -115,20 +340,79 @@ class Tournament(object):
         :param name: Player's name.
         :return:
         """
-        self.cur.execute("select * from players where id = %s;",
-                         (p_id, ))
+        self.__execute("select * from players where id = %s;",
+                       (p_id, ))
         if self.cur.rowcount <= 0:
-            self.cur.execute("insert into players values (%s, %s);", (p_id, name))
-            self.cur.execute("commit;")
+            self.__execute("insert into players values (%s, %s);", (p_id, name))
+            self.conn.commit()
+
+    def register_players(self, rows):
+        """
+        Register players and add them to the tournament in one transaction.
+        Players, who are already registered, keep their names and players,
+        who already participate the tournament, are skipped.
+        :param rows: Iterable of tuples of (player ID, name).
+        :return: Tuple of the number of participants inserted and the number
+                 of rows skipped.
+        """
+        p_ids, names = [], []
+        for p_id, name in rows:
+            p_ids.append(p_id)
+            names.append(name)
+        if not p_ids:
+            return 0, 0
+        self.__bump_version()
+        self.__execute("insert into players (id, name) select distinct on \
+                        (id) id, name from unnest(%s::text[], %s::text[]) \
+                        as rows (id, name) on conflict (id) do nothing;",
+                       (p_ids, names))
+        self.__execute("insert into participants (t_id, p_id) select \
+                        distinct %s::integer, id from \
+                        unnest(%s::text[]) as id \
+                        on conflict (t_id, p_id) do nothing;",
+                       (self.t_id, p_ids))
+        inserted = self.cur.rowcount
+        self.__execute("insert into standings (t_id, p_id, version) select \
+                        %s::integer, id, (select version from tournaments \
+                        where id = %s) from unnest(%s::text[]) as id on \
+                        conflict (t_id, p_id) do nothing;",
+                       (self.t_id, self.t_id, p_ids))
+        self.conn.commit()
+        return inserted, len(p_ids) - inserted
 
     def unregister_player(self, p_id):
         """
-        Unregister the player from the system.
+        Unregister the player from the system. A player, who has played or
+        participates any tournament, cannot be unregistered. Use
+        withdraw_player() to leave a tournament.
         :param p_id: Player ID.
         :return:
         """
-        self.cur.execute("delete players where p_id = %s;", (p_id, ))
-        self.cur.execute("commit;")
+        self.__execute("delete from players where id = %s;", (p_id, ))
+        self.conn.commit()
+
+    def withdraw_player(self, p_id):
+        """
+        Withdraw the player from the rest of the tournament. The results of
+        the player are kept, so the tiebreaks of the opponents do not change,
+        but the player is left out of the standings and pairings. Only the
+        rows of the player are updated.
+        :param p_id: Player ID.
+        :return:
+        """
+        self.__bump_version(reset=True)
+        self.__execute("update participants set withdrawn = true where \
+                        t_id = %s and p_id = %s and not withdrawn;",
+                       (self.t_id, p_id))
+        if self.cur.rowcount <= 0:
+            self.conn.rollback()
+            raise ValueError("%s does not participate the tournament." % p_id)
+        self.__execute("update standings set withdrawn = true, \
+                        version = (select version from tournaments \
+                        where id = %s) \
+                        where t_id = %s and p_id = %s;",
+                       (self.t_id, self.t_id, p_id))
+        self.conn.commit()
 
     def participate(self, p_id):
         """
@@ -136,13 +420,42 @@ class Tournament(object):
         :param p_id: Player ID.
         :return:
         """
-        self.cur.execute("insert into participants values (%s, %s);",
-                         (self.t_id, p_id))
-        self.cur.execute("commit;")
+        self.__bump_version()
+        self.__execute("insert into participants values (%s, %s);",
+                       (self.t_id, p_id))
+        self.__execute("insert into standings (t_id, p_id, version) \
+                        select %s::integer, %s::text, version from \
+                        tournaments where id = %s;",
+                       (self.t_id, p_id, self.t_id))
+        self.conn.commit()
 
-    def player_standings(self):
+    def __execute_standings(self, cur):
         """
-        Check the current player standings.
+        Execute the standings query of the tournament on the given cursor.
+        The standings table is maintained by report_match, so reading it
+        costs O(players) regardless of the number of matches. Withdrawn
+        players are left out by the partial standings_order_idx. Rows are
+        (id, name, wins, matches, score) ordered by the score.
+        :param cur: Cursor to execute the query on.
+        :return:
+        """
+        self.__execute("select standings.p_id, players.name, \
+                        standings.wins, standings.matches, standings.score \
+                        from standings join players on \
+                        standings.p_id = players.id \
+                        where standings.t_id = %s and not \
+                        standings.withdrawn order by standings.score desc, \
+                        standings.tiebreak desc;", (self.t_id, ), cur)
+
+    def player_standings(self, tiebreaks=None):
+        """
+        Check the current player standings. If the tournament has a cache,
+        the standings are built once per result version.
+        Players are ordered by the score of the scoring system of the
+        tournament.
+        :param tiebreaks: Names of the tiebreaks defined in tiebreak module,
+                          which order players with the same score. If None,
+                          the tiebreak column of the standings table is used.
         :return:
             A list of tuples, each of which contains (id, name, wins, matches):
             id: the player's unique id
@@ -150,97 +463,741 @@ class Tournament(object):
             wins: the number of matches the player has won
             matches: the number of matches the player has played
         """
-        self.cur.execute("select standings.p_id, players.name, sum from \
-                          standings_%s standings join players on standings.p_id\
-                          = players.id where standings.t_id = %s order by sum \
-                          desc;", (self.t_id, self.t_id))
-        rows = self.cur.fetchall()
-        standings = []
-        for row in rows:
-            self.cur.execute("select count(id) from matches where t_id = %s\
-                              and p_id = %s group by id;", (self.t_id, row[0]))
-            gp = self.cur.fetchone()
-            if gp is None:
-                standings.append((row[0], row[1], 0, 0))
+        tiebreaks = tuple(tiebreaks or ())
+        for name in tiebreaks:
+            if name not in tiebreak.TIEBREAKS:
+                raise ValueError("Unknown tiebreak, %s." % name)
+        return self.__cached("standings", lambda: self.__standings(tiebreaks),
+                             tiebreaks)
+
+    def __standings(self, tiebreaks):
+        """
+        Build the current player standings.
+        :param tiebreaks: Tuple of the names of the tiebreaks.
+        :return: A list of tuples of (id, name, wins, matches).
+        """
+        self.__execute_standings(self.cur)
+        standings = self.cur.fetchall()
+        if tiebreaks:
+            engine = self.tiebreaks(standings)
+            standings.sort(key=lambda row: (row[4],
+                                            engine.get(row[0], tiebreaks)),
+                           reverse=True)
+        return [row[:4] for row in standings]
+
+    def tiebreaks(self, standings=None):
+        """
+        Get the tiebreak engine of the tournament. It is loaded together with
+        the opponent history and kept up to date by the results reported
+        through this object, so that only the players, whose opponents'
+        results have changed, are recomputed.
+        :param standings: Current result of player_standings(), if any.
+        :return: tiebreak.Tiebreaks.
+        """
+        self.history(standings)
+        return self.__tiebreaks
+
+    def history(self, standings=None):
+        """
+        Get the opponent history of the tournament. It is loaded from the
+        matches table with one query and then kept up to date by the results
+        reported through this object. It is reloaded when the given standings
+        show matches it has not seen.
+        :param standings: Current result of player_standings(), if any.
+        :return: history.OpponentHistory.
+        """
+        history = self.__history
+        if history is not None and standings is not None:
+            for row in standings:
+                if history.matches(row[0]) != row[3]:
+                    history = None
+                    break
+        if history is None:
+            history = self.__load_history()
+        return history
+
+    def __load_history(self):
+        """
+        Load the opponent history and the tiebreak engine from the matches
+        table with one query.
+        :return: history.OpponentHistory.
+        """
+        history = OpponentHistory()
+        engine = tiebreak.Tiebreaks(self.scoring())
+        self.__execute("select p_id from participants where t_id = %s;",
+                       (self.t_id, ))
+        for row in self.cur.fetchall():
+            history.add_player(row[0])
+            engine.add_player(row[0])
+        self.__execute("select matches.p_id, opponent.p_id, \
+                        matches.points, opponent.points from matches \
+                        left join matches as opponent on \
+                        opponent.t_id = matches.t_id and \
+                        opponent.id = matches.id and \
+                        opponent.p_id <> matches.p_id \
+                        where matches.t_id = %s and \
+                        (opponent.p_id is null or \
+                        matches.p_id < opponent.p_id) \
+                        order by matches.id;", (self.t_id, ))
+        for p1, p2, points1, points2 in self.cur.fetchall():
+            if p2 is None:
+                history.add_bye(p1)
+                engine.add_bye(p1)
             else:
-                standings.append((row[0], row[1], row[2], gp[0]))
-        return standings
+                history.add_match(p1, p2)
+                engine.add_result(p1, p2, self.__result(points1, points2))
+        self.__history = history
+        self.__tiebreaks = engine
+        return history
 
-    def report_match(self, winner, loser):
+    @staticmethod
+    def __result(points, opponent_points):
+        """
+        Score of a player in a match for the tiebreaks.
+        :param points: Points the player earned.
+        :param opponent_points: Points the opponent earned.
+        :return: 1 for a win, 0.5 for a draw and 0 for a loss.
+        """
+        if points > opponent_points:
+            return 1
+        elif points == opponent_points:
+            return 0.5
+        return 0
+
+    def iter_player_standings(self, itersize=2000):
+        """
+        Iterate the current player standings with a server-side cursor, so
+        that only itersize rows are held in memory at a time.
+        :param itersize: The number of rows fetched per round trip.
+        :return: Generator of the same tuples as player_standings().
         """
-        Report the match result.
+        cur = self.conn.cursor("standings_%s" % self.t_id)
+        cur.itersize = itersize
+        try:
+            self.__execute_standings(cur)
+            for row in cur:
+                yield row[:4]
+        finally:
+            cur.close()
+
+    def standings_changes(self, since=None, itersize=2000):
+        """
+        Stream the standings, which changed after the given version, from one
+        snapshot of the tournament with a server-side cursor. The snapshot is
+        a repeatable read transaction, so any open transaction of this object
+        is rolled back first, and the snapshot ends when the generator is
+        exhausted, closed or garbage collected, even if it is never iterated.
+        :param since: Version a client has already seen. All standings are
+                      returned if None, or if standings were deleted after it.
+        :param itersize: The number of rows fetched per round trip.
+        :return: Tuple of the version of the snapshot, True if all standings
+                 are returned, and a generator of tuples of
+                 (id, name, wins, matches, tiebreak, score) in standings
+                 order.
+        """
+        changes = self.__iter_changes(since, itersize)
+        version, full = next(changes)
+        return version, full, changes
+
+    def __iter_changes(self, since, itersize):
+        """
+        Open the snapshot, yield its version first and then the standings
+        changed after the given version, and end the snapshot. The snapshot
+        is opened inside the generator, so that closing the generator after
+        the first item ends it. The snapshot stays on the connection the
+        generator started on. If the handle has been detached since, the
+        snapshot was already rolled back with it, and the connection, which
+        may serve another call by now, is left alone.
+        :param since: Version a client has already seen, or None.
+        :param itersize: The number of rows fetched per round trip.
+        :return: Generator of a tuple of the version and True if all
+                 standings follow, and then tuples of
+                 (id, name, wins, matches, tiebreak, score).
+        """
+        conn, attachment = self.conn, self.__attachments
+        conn.rollback()
+        cur = conn.cursor()
+        try:
+            cur.execute("set transaction isolation level repeatable read;")
+            self.__execute("select version, reset_version from tournaments \
+                            where id = %s;", (self.t_id, ), cur)
+            version, reset_version = cur.fetchone()
+            cur.close()
+            full = since is None or since < reset_version or since > version
+            yield version, full
+            cur = conn.cursor("standings_changes_%s" % self.t_id)
+            cur.itersize = itersize
+            query = "select standings.p_id, players.name, standings.wins, \
+                     standings.matches, standings.tiebreak, standings.score \
+                     from standings \
+                     join players on standings.p_id = players.id \
+                     where standings.t_id = %s and not standings.withdrawn"
+            if full:
+                cur.execute(query + " order by standings.score desc, \
+                            standings.tiebreak desc;", (self.t_id, ))
+            else:
+                cur.execute(query + " and standings.version > %s \
+                            order by standings.score desc, \
+                            standings.tiebreak desc;", (self.t_id, since))
+            for row in cur:
+                yield row
+        finally:
+            if self.conn is conn and self.__attachments == attachment:
+                cur.close()
+                conn.rollback()
+
+    def __update_standings(self, results):
+        """
+        Apply match results to the standings table. This does not commit, so
+        it runs in the same transaction as the insert of the results.
+        :param results: List of tuples of (winner, loser, draw).
+        :return:
+        """
+        players, opponents, wins, losses, draws = [], [], [], [], []
+        for winner, loser, draw in results:
+            players.extend((winner, loser))
+            opponents.extend((loser, winner))
+            if draw:
+                wins.extend((0, 0))
+                losses.extend((0, 0))
+                draws.extend((1, 1))
+            else:
+                wins.extend((1, 0))
+                losses.extend((0, 1))
+                draws.extend((0, 0))
+        self.__execute("update standings set \
+                        wins = standings.wins + delta.wins, \
+                        losses = standings.losses + delta.losses, \
+                        matches = standings.matches + delta.matches, \
+                        score = standings.score + \
+                        delta.wins * tournaments.win_points + \
+                        delta.draws * tournaments.draw_points + \
+                        delta.losses * tournaments.loss_points, \
+                        opponents = standings.opponents || delta.opponents, \
+                        version = tournaments.version \
+                        from (select p_id, sum(win) as wins, \
+                        sum(loss) as losses, sum(draw) as draws, \
+                        count(*) as matches, \
+                        array_agg(opponent) as opponents from \
+                        unnest(%s::text[], %s::text[], %s::integer[], \
+                        %s::integer[], %s::integer[]) as results (p_id, \
+                        opponent, win, loss, draw) group by p_id) as delta, \
+                        tournaments \
+                        where tournaments.id = %s and standings.t_id = %s \
+                        and standings.p_id = delta.p_id;",
+                       (players, opponents, wins, losses, draws, self.t_id,
+                        self.t_id))
+        self.__update_tiebreaks(players)
+
+    def __update_tiebreaks(self, players=None):
+        """
+        Recompute the tiebreak score, which is the sum of the scores of the
+        opponents, of the given players and of everyone who played them.
+        :param players: List of player IDs. All participants if None.
+        :return:
+        """
+        query = "update standings set tiebreak = coalesce((select \
+                 sum(opponent.score) from unnest(standings.opponents) as \
+                 played (p_id) join standings as opponent on \
+                 opponent.t_id = standings.t_id and \
+                 opponent.p_id = played.p_id), 0), version = (select \
+                 version from tournaments where id = %s) \
+                 where standings.t_id = %s"
+        if players is None:
+            self.__execute(query + ";", (self.t_id, self.t_id))
+        else:
+            self.__execute(query + " and (standings.p_id = any(%s) or \
+                           standings.opponents && %s::text[]);",
+                           (self.t_id, self.t_id, players, players))
+
+    def rebuild_standings(self):
+        """
+        Rebuild the standings of the tournament from the matches table. This
+        is meant for recovery when the standings table is out of sync.
+        :return:
+        """
+        self.__bump_version()
+        self.__execute("select pg_advisory_xact_lock(%s);", (self.t_id, ))
+        self.__execute("delete from standings where t_id = %s;",
+                       (self.t_id, ))
+        self.__execute("insert into standings (t_id, p_id, wins, losses, \
+                        matches, score, opponents, byes, version, \
+                        withdrawn) \
+                        select participants.t_id, \
+                        participants.p_id, \
+                        sum(case when matches.points > opponent.points or \
+                        (matches.id is not null and opponent.p_id is null) \
+                        then 1 else 0 end), \
+                        sum(case when matches.points < opponent.points \
+                        then 1 else 0 end), count(matches.id), \
+                        coalesce(sum(matches.points), 0), \
+                        array_remove(array_agg(opponent.p_id), null), \
+                        count(matches.id) - count(opponent.p_id), \
+                        (select version from tournaments where id = %s), \
+                        participants.withdrawn \
+                        from participants left join matches on \
+                        matches.t_id = participants.t_id and \
+                        matches.p_id = participants.p_id \
+                        left join matches as opponent on \
+                        opponent.t_id = matches.t_id and \
+                        opponent.id = matches.id and \
+                        opponent.p_id <> matches.p_id \
+                        where participants.t_id = %s \
+                        group by participants.t_id, participants.p_id, \
+                        participants.withdrawn;",
+                       (self.t_id, self.t_id))
+        self.__update_tiebreaks()
+        self.conn.commit()
+        self.__tiebreaks = None
+        self.__history = None
+
+    def __insert_matches(self, results, round=None):
+        """
+        Insert match results with a single statement. Each match gets its own
+        ID from matches_id_seq, which is shared by the rows of both players,
+        and each player the points of the scoring system of the tournament.
+        This takes the advisory lock of the tournament and does not commit.
+        :param results: List of tuples of (winner, loser, draw).
+        :param round: Round of the matches. If None, each match is in the
+                      round after the last one either player has played.
+        :return:
+        """
+        winners, losers, draws = [], [], []
+        for winner, loser, draw in results:
+            winners.append(winner)
+            losers.append(loser)
+            draws.append(draw)
+        self.__execute("select pg_advisory_xact_lock(%s);", (self.t_id, ))
+        self.__execute("with match as (select nextval('matches_id_seq') \
+                        as id, winner, loser, draw, \
+                        coalesce(%s::integer, greatest(w.matches, \
+                        l.matches) + 1) as round from \
+                        unnest(%s::text[], %s::text[], %s::boolean[]) as \
+                        results (winner, loser, draw) \
+                        left join standings as w on w.t_id = %s and \
+                        w.p_id = results.winner \
+                        left join standings as l on l.t_id = %s and \
+                        l.p_id = results.loser) \
+                        insert into matches (id, t_id, p_id, points, round) \
+                        select match.id, tournaments.id, result.p_id, \
+                        result.points, match.round from match \
+                        join tournaments on tournaments.id = %s, \
+                        lateral (values (match.winner, case when match.draw \
+                        then tournaments.draw_points \
+                        else tournaments.win_points end), \
+                        (match.loser, case when match.draw \
+                        then tournaments.draw_points \
+                        else tournaments.loss_points end)) \
+                        as result (p_id, points);",
+                       (round, winners, losers, draws, self.t_id, self.t_id,
+                        self.t_id))
+
+    def report_match(self, winner, loser, draw=False, round=None):
+        """
+        Report the match result. The match ID is allocated by matches_id_seq
+        and the standings of both players are updated in the same
+        transaction. Reporters of the same tournament are serialized by an
+        advisory lock, so that concurrent standings updates do not deadlock.
+        Both players must participate the tournament and not have withdrawn,
+        as checked by report_matches().
         :param winner: Player ID of the user.
         :param loser: Player ID of the loser.
+        :param draw: True if the match is a draw. Neither player wins.
+        :param round: Round of the match. If None, the round after the last
+                      one either player has played.
+        :return:
+        """
+        self.report_matches([(winner, loser, draw)], round=round)
+
+    def report_matches(self, results, pairings=None, round=None):
+        """
+        Report a batch of match results in one transaction. The results are
+        inserted with a single statement and the standings are updated once
+        at the end. The bye in the pairings, if any, is recorded as well.
+        :param results: Iterable of tuples of (winner, loser) or
+                        (winner, loser, draw).
+        :param pairings: Pairings as returned by swiss_pairings(). If given,
+                         each pairing must have exactly one result.
+        :param round: Round of the matches. If None, each match is in the
+                      round after the last one either player has played.
+        :return: The number of matches reported.
+        """
+        results = [(result[0], result[1],
+                    len(result) > 2 and bool(result[2])) for result in results]
+        if not results:
+            return 0
+        players = set()
+        for winner, loser, draw in results:
+            if winner == loser:
+                raise ValueError("%s cannot play against self." % winner)
+            players.update((winner, loser))
+        self.__execute("select p_id from participants where t_id = %s \
+                        and p_id = any(%s) and not withdrawn;",
+                       (self.t_id, list(players)))
+        unknown = players - set(row[0] for row in self.cur.fetchall())
+        if unknown:
+            raise ValueError("%s do not participate the tournament." %
+                             ", ".join(sorted(unknown)))
+        if pairings is not None:
+            pairing.check_pairings(results, pairings)
+        self.__bump_version()
+        self.__insert_matches(results, round)
+        self.__update_standings(results)
+        byes = []
+        if pairings is not None:
+            byes = [entry[0] for entry in pairings if len(entry) == 2]
+            for p_id in byes:
+                self.__record_bye(p_id, round)
+        if self.rated:
+            rating.update_ratings(self.cur, results)
+        self.conn.commit()
+        self.__add_results(results, byes)
+        return len(results)
+
+    def __add_results(self, results, byes=()):
+        """
+        Add committed results to the opponent history and the tiebreak
+        engine, if they are loaded.
+        :param results: List of tuples of (winner, loser, draw).
+        :param byes: List of player IDs, who got a bye.
         :return:
         """
-        self.cur.execute("select max(id) from matches;")
-        row = self.cur.fetchone()
-        match = 1
-        if not (row[0] is None):
-            match = row[0] + 1
+        history, engine = self.__history, self.__tiebreaks
+        if history is None:
+            return
+        for winner, loser, draw in results:
+            history.add_match(winner, loser)
+            engine.add_result(winner, loser, 0.5 if draw else 1)
+        for p_id in byes:
+            history.add_bye(p_id)
+            engine.add_bye(p_id)
+
+    def __record_bye(self, p_id, round=None):
+        """
+        Record a bye, which is a won match without opponent worth the bye
+        points of the tournament. This does not commit.
+        :param p_id: Player ID of the player, who gets the bye.
+        :param round: Round of the bye. If None, the round after the last one
+                      the player has played.
+        :return:
+        """
+        self.__execute("select pg_advisory_xact_lock(%s);", (self.t_id, ))
+        self.__execute("insert into matches (id, t_id, p_id, points, \
+                        round) select nextval('matches_id_seq'), \
+                        standings.t_id, standings.p_id, \
+                        tournaments.bye_points, \
+                        coalesce(%s::integer, standings.matches + 1) \
+                        from standings join tournaments on \
+                        tournaments.id = standings.t_id \
+                        where standings.t_id = %s and standings.p_id = %s \
+                        and not standings.withdrawn;",
+                       (round, self.t_id, p_id))
+        if self.cur.rowcount <= 0:
+            raise ValueError("%s does not participate the tournament." % p_id)
+        self.__execute("update standings set wins = standings.wins + 1, \
+                        matches = standings.matches + 1, \
+                        byes = standings.byes + 1, \
+                        score = standings.score + tournaments.bye_points, \
+                        version = tournaments.version from tournaments \
+                        where tournaments.id = standings.t_id and \
+                        standings.t_id = %s and standings.p_id = %s;",
+                       (self.t_id, p_id))
+        self.__update_tiebreaks([p_id])
+
+    def report_bye(self, p_id, round=None):
+        """
+        Report a bye for the player. A bye counts as a won match without
+        opponent, and a player gets at most one bye from swiss_pairings.
+        :param p_id: Player ID.
+        :param round: Round of the bye. If None, the round after the last one
+                      the player has played.
+        :return:
+        """
+        self.__bump_version()
+        self.__record_bye(p_id, round)
+        self.conn.commit()
+        self.__add_results([], [p_id])
+
+    def report_round(self, results, pairings=None, round=None):
+        """
+        Report the results of a whole round. Every pairing of the round must
+        have exactly one result.
+        :param results: Iterable of tuples of (winner, loser) or
+                        (winner, loser, draw).
+        :param pairings: Pairings of the round. The current swiss_pairings()
+                         if None.
+        :param round: Round number. If None, the round after the last one
+                      the players have played.
+        :return: The number of matches reported.
+        """
+        if pairings is None:
+            pairings = self.swiss_pairings()
+        return self.report_matches(results, pairings, round)
+
+    def player_ratings(self, system=rating.ELO):
+        """
+        Get the ratings of the participants, which are kept across
+        tournaments, for seeding. Players without rated matches have the
+        default rating.
+        :param system: rating.ELO or rating.GLICKO2.
+        :return: A list of tuples of (id, name, rating, matches) ordered by
+                 the rating, best first.
+        """
+        if system == rating.ELO:
+            column = "ratings.elo"
+        elif system == rating.GLICKO2:
+            column = "ratings.glicko"
+        else:
+            raise ValueError("Unknown rating system, %s." % system)
+        self.__execute("select participants.p_id, players.name, \
+                        coalesce(%s, %%s), coalesce(ratings.matches, 0) \
+                        from participants join players on \
+                        participants.p_id = players.id left join ratings \
+                        on ratings.p_id = participants.p_id \
+                        where participants.t_id = %%s \
+                        order by 3 desc, participants.p_id;" % column,
+                       (rating.DEFAULT_RATING, self.t_id))
+        return self.cur.fetchall()
+
+    def current_round(self):
+        """
+        Get the last round, which has a result.
+        :return: The round number, or 0 before the first result.
+        """
+        self.__execute("select coalesce(max(round), 0) from matches \
+                        where t_id = %s;", (self.t_id, ))
+        return self.cur.fetchone()[0]
+
+    def player_standings_as_of(self, round):
+        """
+        Check the player standings after the given round. They are built
+        from the matches of the rounds up to the given one in the same order
+        as player_standings(), by score and then by the sum of the scores of
+        the opponents.
+        :param round: Round number.
+        :return: A list of tuples of (id, name, wins, matches) like
+                 player_standings().
+        """
+        return self.__cached("standings_as_of",
+                             lambda: self.__standings_as_of(round), round)
 
-        self.cur.execute("insert into matches values (%s, %s, %s, %s);",
-                         (match, self.t_id, winner, 1))
-        self.cur.execute("insert into matches values (%s, %s, %s, %s);",
-                         (match, self.t_id, loser, 0))
-        self.cur.execute("commit;")
+    def __standings_as_of(self, round):
+        """
+        Build the player standings after the given round.
+        :param round: Round number.
+        :return: A list of tuples of (id, name, wins, matches).
+        """
+        self.__execute("with played as (select matches.p_id, \
+                        matches.points, opponent.p_id as opponent, \
+                        opponent.points as opponent_points \
+                        from matches left join matches as opponent on \
+                        opponent.t_id = matches.t_id and \
+                        opponent.id = matches.id and \
+                        opponent.p_id <> matches.p_id \
+                        where matches.t_id = %s and matches.round <= %s), \
+                        totals as (select participants.p_id, \
+                        (count(played.p_id) filter (where \
+                        played.opponent is null or \
+                        played.points > played.opponent_points))::integer \
+                        as wins, \
+                        count(played.p_id)::integer as matches, \
+                        coalesce(sum(played.points), 0)::integer as score \
+                        from participants left join played on \
+                        played.p_id = participants.p_id \
+                        where participants.t_id = %s \
+                        group by participants.p_id) \
+                        select totals.p_id, players.name, totals.wins, \
+                        totals.matches from totals join players on \
+                        totals.p_id = players.id left join \
+                        (select played.p_id, sum(opponent.score) as \
+                        tiebreak from played join totals as opponent on \
+                        opponent.p_id = played.opponent \
+                        group by played.p_id) as tiebreaks on \
+                        tiebreaks.p_id = totals.p_id \
+                        order by totals.score desc, \
+                        coalesce(tiebreaks.tiebreak, 0) desc;",
+                       (self.t_id, round, self.t_id))
+        return self.cur.fetchall()
+
+    def round_pairings(self, round):
+        """
+        Get the pairings, which were played in the given round.
+        :param round: Round number.
+        :return: A list of tuples of (id1, name1, id2, name2) in the order the
+                 matches were reported, and (id, name) of the player, who got
+                 a bye, like swiss_pairings().
+        """
+        self.__execute("select matches.p_id, players.name, opponent.p_id, \
+                        opponent_player.name from matches \
+                        join players on players.id = matches.p_id \
+                        left join matches as opponent on \
+                        opponent.t_id = matches.t_id and \
+                        opponent.id = matches.id and \
+                        opponent.p_id <> matches.p_id \
+                        left join players as opponent_player on \
+                        opponent_player.id = opponent.p_id \
+                        where matches.t_id = %s and matches.round = %s \
+                        and (opponent.p_id is null or \
+                        matches.points > opponent.points or \
+                        (matches.points = opponent.points and \
+                        matches.p_id < opponent.p_id)) \
+                        order by opponent.p_id is null, matches.id;",
+                       (self.t_id, round))
+        return [row if row[2] is not None else row[:2]
+                for row in self.cur.fetchall()]
 
     def swiss_pairings(self):
         """
-        Pairings for the next round.
+        Pairings for the next round. Players are paired within their score
+        group where possible, never against an opponent they have already
+        met unless there is no other way, and with an odd number of players
+        the lowest ranked player without a bye so far gets a bye.
         :return:
           A list of tuples, each of which contains (id1, name1, id2, name2)
             id1: the first player's unique id
             name1: the first player's name
             id2: the second player's unique id
             name2: the second player's name
+          With an odd number of players, the last tuple is (id, name) of the
+          player, who gets a bye.
         """
-        standings = self.player_standings()
-        parings = []
-        p1 = None
-        i = 0
+        return self.__cached("pairings", self.__swiss_pairings)
+
+    def __swiss_pairings(self):
+        """
+        Build the pairings for the next round from the standings and the
+        opponent history.
+        :return: A list of tuples of (id1, name1, id2, name2) and (id, name).
+        """
+        self.__execute_standings(self.cur)
+        rows = self.cur.fetchall()
+        names = dict((row[0], row[1]) for row in rows)
+        pairs, bye = pairing.swiss_pairings([row[0] for row in rows],
+                                            self.history(rows))
+        pairings = [(p1, names[p1], p2, names[p2]) for p1, p2 in pairs]
+        if bye is not None:
+            pairings.append((bye, names[bye]))
+        return pairings
+
+
+def connect():
+    """Connect to the PostgreSQL database.  Returns a database connection."""
+    return psycopg2.connect(DSN)
+
+
+def forget_tournament_ids():
+    """
+    Clear the cached tournament IDs, like after the tournament schema has
+    been dropped and created again.
+    :return:
+    """
+    _tournament_ids.clear()
+
 
-        for player in standings:
-            if i % 2 == 1:
-                parings.append((p1[0], p1[1], player[0], player[1]))
-            elif i == len(standings):
-                parings.append((player[0], player[1]))
+_pool = None
+_tournaments = {}
+_locks = {}
+_lock = threading.RLock()
+
+
+def get_pool(minconn=1, maxconn=10, **kwargs):
+    """
+    Get the process-wide connection pool. It is created on the first call.
+    :param minconn: The number of connections kept open.
+    :param maxconn: The maximum number of connections.
+    :param kwargs: Keyword arguments of psycopg2.connect, like
+                   cursor_factory, used when the pool is created.
+    :return: psycopg2.pool.ThreadedConnectionPool.
+    """
+    global _pool
+    with _lock:
+        if _pool is None or _pool.closed:
+            _pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, DSN,
+                                                         **kwargs)
+        return _pool
+
+
+@contextlib.contextmanager
+def get_tournament(name=Tournament.default):
+    """
+    Context manager of the cached Tournament handle for the given
+    tournament. The handle is kept for the process, so the tournament lookup
+    is done only once, and gets a pooled connection for the duration of the
+    block. Other threads wait until the block exits to use the same
+    tournament, so that a rollback of one call never ends the transaction of
+    another. The transaction is ended on exit, so that the pooled connection
+    is not left idle in transaction after reads or failed writes.
+    :param name: Name of tournament.
+    """
+    with _lock:
+        lock = _locks.get(name)
+        if lock is None:
+            lock = _locks[name] = threading.RLock()
+    with lock:
+        pool = get_pool()
+        conn = pool.getconn()
+        tournament = _tournaments.get(name)
+        try:
+            if tournament is None:
+                tournament = Tournament(conn, name)
+                _tournaments[name] = tournament
             else:
-                p1 = player
+                tournament.attach(conn)
+            yield tournament
+        finally:
+            if tournament is not None and tournament.conn is conn:
+                tournament.detach()
+            elif not conn.closed:
+                conn.rollback()
+            pool.putconn(conn, close=bool(conn.closed))
 
-            i += 1
 
-        return parings
+def close_tournaments():
+    """
+    Forget the cached Tournament handles and close the pool.
+    :return:
+    """
+    global _pool
+    with _lock:
+        _tournaments.clear()
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
 
 
-def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    return psycopg2.connect("dbname=tournament")
+def default_tournament():
+    """
+    Context manager of the default tournament handle used by the functions
+    below.
+    """
+    return get_tournament(Tournament.default)
+
+
+def player_id(name):
+    """
+    Make the player ID used by registerPlayer for the given name.
+    :param name: Player's name.
+    :return: Player ID.
+    """
+    return name.lower().replace(" ", "_") + "@udacity.com"
 
 
 def deleteMatches():
     """Remove all the match records from the database."""
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    tournament.delete_matches()
-    tournament.close()
+    with default_tournament() as tournament:
+        tournament.delete_matches()
 
 
 def deletePlayers():
     """Remove all the player records from the database."""
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    tournament.delete_players()
-    tournament.close()
+    with default_tournament() as tournament:
+        tournament.delete_players()
 
 
 def countPlayers():
     """Returns the number of players currently registered."""
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    count = tournament.count_players()
-    tournament.close()
-    return count
+    with default_tournament() as tournament:
+        return tournament.count_players()
 
 
 def registerPlayer(name):
@@ -252,12 +1209,10 @@ def registerPlayer(name):
     Args:
       name: the player's full name (need not be unique).
     """
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    p_id = name.lower().replace(" ", "_") + "@udacity.com"
-    tournament.register_player(p_id , name)
-    tournament.participate(p_id)
-    tournament.close()
+    p_id = player_id(name)
+    with default_tournament() as tournament:
+        tournament.register_player(p_id , name)
+        tournament.participate(p_id)
 
 
 def playerStandings():
@@ -273,11 +1228,8 @@ def playerStandings():
         wins: the number of matches the player has won
         matches: the number of matches the player has played
     """
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    standings = tournament.player_standings()
-    tournament.close()
-    return standings
+    with default_tournament() as tournament:
+        return tournament.player_standings()
 
 
 def reportMatch(winner, loser):
@@ -287,9 +1239,8 @@ def reportMatch(winner, loser):
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
     """
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    tournament.report_match(winner, loser)
+    with default_tournament() as tournament:
+        tournament.report_match(winner, loser)
 
 
 def swissPairings():
@@ -307,6 +1258,5 @@ def swissPairings():
         id2: the second player's unique id
         name2: the second player's name
     """
-    conn = connect()
-    tournament = Tournament(conn, Tournament.default)
-    return tournament.swiss_pairings()
+    with default_tournament() as tournament:
+        return tournament.swiss_pairings()
@@ -10,12 +10,25 @@ drop table tournaments cascade;
 drop table players cascade;
 drop table participants cascade;
 drop table matches cascade;
+drop table standings cascade;
+drop table ratings cascade;
 
 -- tournaments table stores tournament ID and its name.
--- id : serial ID for the tournament, name : name of tournament.
+-- id : serial ID for the tournament, name : name of tournament,
+-- version : result version, which is incremented with every change of results
+-- or participants, and keys the cached standings and pairings,
+-- reset_version : the last version, which deleted standings,
+-- win_points, draw_points, loss_points, bye_points : points of the scoring
+-- system for a win, a draw, a loss and a bye.
 create table tournaments (
     id serial primary key,
-    name text unique
+    name text unique,
+    version bigint not null default 0,
+    reset_version bigint not null default 0,
+    win_points smallint not null default 1,
+    draw_points smallint not null default 0,
+    loss_points smallint not null default 0,
+    bye_points smallint not null default 1
 );
 
 -- players table stores player ID and their full name.
@@ -27,21 +40,90 @@ create table players (
 );
 
 -- participants table stores players, who participate the tournament.
--- t_id : tournament ID, p_id : player ID.
+-- t_id : tournament ID, p_id : player ID,
+-- withdrawn : true if the player has withdrawn from the rest of the
+-- tournament. The results of the player are kept.
 create table participants (
     t_id integer references tournaments (id),
     p_id text references players (id),
+    withdrawn boolean not null default false,
     primary key (t_id, p_id)
 );
 
--- matches table stores game results. Each match will have a integer ID.
+-- Deleting a player from players checks participants and matches by p_id.
+create index participants_p_id_idx on participants (p_id);
+-- Counts and checks of the players, who are still playing.
+create index participants_active_idx on participants (t_id, p_id)
+    where not withdrawn;
+
+-- matches table stores game results. Each match will have a integer ID, which
+-- is shared by the rows of both players and allocated by matches_id_seq.
 -- id : match ID, t_id : tournament ID, p_id : player ID,
--- points : point the player earned.
+-- points : points the player earned by the scoring system of the tournament,
+-- round : round of the match.
+-- Every query filters matches by tournament, so t_id leads the primary key,
+-- which also serves the self join of both rows of a match on (t_id, id).
 create table matches (
-    id integer,
+    id serial,
     t_id integer references tournaments (id),
     p_id text references players (id),
     points integer,
-    primary key (id, t_id, p_id)
+    round integer,
+    primary key (t_id, id, p_id)
+);
+
+-- Covering index for the matches of a player in a tournament.
+create index matches_player_idx on matches (t_id, p_id, id, points);
+create index matches_p_id_idx on matches (p_id);
+-- Standings and pairings as of a round read the matches of the rounds.
+create index matches_round_idx on matches (t_id, round);
+
+-- standings table stores the aggregated results of each participant. It is
+-- maintained by report_match in the same transaction as the match, so reading
+-- standings does not re-aggregate matches.
+-- t_id : tournament ID, p_id : player ID, wins : matches won,
+-- losses : matches lost, matches : matches played,
+-- score : points earned, which rank the standings,
+-- opponents : player IDs of the opponents in the order they were played,
+-- tiebreak : sum of the scores of the opponents,
+-- byes : matches without opponent, which count as won,
+-- version : version of the tournament, which changed the row last,
+-- withdrawn : copy of participants.withdrawn, so that standings and pairings
+-- skip withdrawn players without a join.
+create table standings (
+    t_id integer,
+    p_id text,
+    wins integer not null default 0,
+    losses integer not null default 0,
+    matches integer not null default 0,
+    score integer not null default 0,
+    opponents text[] not null default '{}',
+    tiebreak integer not null default 0,
+    byes integer not null default 0,
+    version bigint not null default 0,
+    withdrawn boolean not null default false,
+    primary key (t_id, p_id),
+    foreign key (t_id, p_id) references participants (t_id, p_id)
+        on delete cascade
 );
 
+-- Standings and pairings read the players, who have not withdrawn, in this
+-- order.
+create index standings_order_idx on standings (t_id, score desc, tiebreak desc)
+    where not withdrawn;
+-- Exports read the standings changed since a version.
+create index standings_version_idx on standings (t_id, version);
+
+-- ratings table stores the ratings of each player across tournaments. It is
+-- updated by report_match and recomputed from all matches by rating.py.
+-- p_id : player ID, elo : Elo rating, glicko : Glicko-2 rating,
+-- glicko_rd : Glicko-2 rating deviation,
+-- glicko_volatility : Glicko-2 volatility, matches : matches rated.
+create table ratings (
+    p_id text primary key references players (id) on delete cascade,
+    elo double precision not null default 1500,
+    glicko double precision not null default 1500,
+    glicko_rd double precision not null default 350,
+    glicko_volatility double precision not null default 0.06,
+    matches integer not null default 0
+);
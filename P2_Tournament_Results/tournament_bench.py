@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+"""
+Benchmarks for tournament.py
+tournament_bench.py -- measure database round trips and timings of the
+Tournament class against the tournament database.
+
+By default, a full Swiss event is simulated through the Tournament class and
+through the legacy function API, and latency percentiles, statements per
+operation and total wall time are reported for each operation. The other
+benchmarks can be run by name, e.g. "python tournament_bench.py pairing".
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import pairing
+import rating
+import tiebreak
+import tournament as legacy
+from history import OpponentHistory
+from tournament import Tournament
+
+BENCH_TOURNAMENT = "__BENCH__"
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """ Cursor, which counts the statements sent to the database. """
+
+    statements = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super(CountingCursor, self).execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        CountingCursor.statements += 1
+        return super(CountingCursor, self).executemany(query, vars_list)
+
+
+def bench_connect():
+    """
+    Connect to the tournament database with the counting cursor.
+    :return: The database connection.
+    """
+    return psycopg2.connect(legacy.DSN, cursor_factory=CountingCursor)
+
+
+def populate(tournament, size):
+    """
+    Register size players to the tournament and report one round of matches.
+    :param tournament: Tournament.
+    :param size: The number of players.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    for i in xrange(size):
+        p_id = "bench.player.%d@udacity.com" % i
+        tournament.register_player(p_id, "Bench Player %d" % i)
+        tournament.participate(p_id)
+    standings = tournament.player_standings()
+    for i in xrange(0, len(standings) - 1, 2):
+        tournament.report_match(standings[i][0], standings[i + 1][0])
+
+
+def bench_standings(sizes=(10, 100, 1000, 2000)):
+    """
+    Measure the statements and the time player_standings takes for each size
+    of the field. The number of statements should stay the same.
+    :param sizes: The numbers of players to measure.
+    :return:
+    """
+    conn = bench_connect()
+    tournament = Tournament(conn, BENCH_TOURNAMENT)
+    print "player_standings: players, statements, msec"
+    for size in sizes:
+        populate(tournament, size)
+        CountingCursor.statements = 0
+        start = time.time()
+        standings = tournament.player_standings()
+        elapsed = (time.time() - start) * 1000
+        assert len(standings) == size
+        print "%d, %d, %.2f" % (size, CountingCursor.statements, elapsed)
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.close()
+
+
+def bench_report_match(count=500):
+    """
+    Compare the throughput of repeated reportMatch calls, which use the pooled
+    connection and the cached default tournament, with opening a connection
+    and constructing a Tournament per call. This clears the default
+    tournament.
+    :param count: The number of matches to report.
+    :return:
+    """
+    legacy.deleteMatches()
+    legacy.deletePlayers()
+    legacy.registerPlayer("Bench Winner")
+    legacy.registerPlayer("Bench Loser")
+    winner, loser = [row[0] for row in legacy.playerStandings()]
+
+    start = time.time()
+    for i in xrange(count):
+        conn = legacy.connect()
+        tournament = Tournament(conn, Tournament.default)
+        tournament.report_match(winner, loser)
+        tournament.close()
+    per_connection = count / (time.time() - start)
+
+    start = time.time()
+    for i in xrange(count):
+        legacy.reportMatch(winner, loser)
+    pooled = count / (time.time() - start)
+
+    print "reportMatch: matches/sec"
+    print "connection per call, %.1f" % per_connection
+    print "pooled handle, %.1f" % pooled
+    legacy.deleteMatches()
+    legacy.deletePlayers()
+    legacy.close_tournaments()
+
+
+def bench_report_round(size=512):
+    """
+    Compare reporting a round of size / 2 matches with report_round against
+    looping over report_match.
+    :param size: The number of players.
+    :return:
+    """
+    conn = bench_connect()
+    tournament = Tournament(conn, BENCH_TOURNAMENT)
+    populate(tournament, size)
+    print "round of %d matches: method, statements, msec" % (size / 2)
+    for method in ("report_match", "report_round"):
+        results = [(pairing[0], pairing[2])
+                   for pairing in tournament.swiss_pairings()]
+        CountingCursor.statements = 0
+        start = time.time()
+        if method == "report_match":
+            for winner, loser in results:
+                tournament.report_match(winner, loser)
+        else:
+            tournament.report_round(results)
+        elapsed = (time.time() - start) * 1000
+        print "%s, %d, %.2f" % (method, CountingCursor.statements, elapsed)
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.close()
+
+
+def bench_pairing(sizes=(64, 256, 1024, 4096, 10000), rounds=9):
+    """
+    Measure the pairing engine on simulated events without the database.
+    Each round is paired from the simulated standings and won at random.
+    :param sizes: The numbers of players to measure.
+    :param rounds: The number of rounds simulated for each size.
+    :return:
+    """
+    print "swiss_pairings: players, worst msec per round, rematches"
+    for size in sizes:
+        players = range(size)
+        wins = dict((p, 0) for p in players)
+        history = OpponentHistory()
+        worst = 0
+        rematches = 0
+        for round in xrange(rounds):
+            order = sorted(players, key=lambda p: -wins[p])
+            start = time.time()
+            pairs, bye = pairing.swiss_pairings(order, history)
+            worst = max(worst, time.time() - start)
+            for p1, p2 in pairs:
+                if history.have_met(p1, p2):
+                    rematches += 1
+                history.add_match(p1, p2)
+                wins[random.choice((p1, p2))] += 1
+            if bye is not None:
+                history.add_bye(bye)
+                wins[bye] += 1
+        print "%d, %.2f, %d" % (size, worst * 1000, rematches)
+
+
+def bench_tiebreaks(size=10000, rounds=9):
+    """
+    Compare computing the tiebreaks of every player with recomputing them
+    after one more round, on a simulated event without the database.
+    :param size: The number of players.
+    :param rounds: The number of rounds before the measured round.
+    :return:
+    """
+    engine = tiebreak.Tiebreaks()
+    players = range(size)
+    for round in xrange(rounds + 1):
+        if round == rounds:
+            start = time.time()
+            engine.compute()
+            full = time.time() - start
+        random.shuffle(players)
+        for i in xrange(0, size - 1, 2):
+            engine.add_result(players[i], players[i + 1], random.choice(
+                (0, 0.5, 1)))
+    start = time.time()
+    engine.compute()
+    incremental = time.time() - start
+    print "tiebreaks of %d players after %d rounds: msec" % (size, rounds)
+    print "all players, %.2f" % (full * 1000)
+    print "after one round, %.2f" % (incremental * 1000)
+
+
+def bench_ratings(matches=1000000, size=100000, sample=20000):
+    """
+    Measure recomputing Elo and Glicko-2 ratings from a simulated history
+    without the database, with NumPy and match by match.
+    :param matches: The number of historical matches.
+    :param size: The number of players.
+    :param sample: The number of matches rated match by match. The time of
+                   the whole history is extrapolated from it.
+    :return:
+    """
+    first, second, scores = [], [], []
+    for i in xrange(matches):
+        p1 = random.randrange(size)
+        p2 = random.randrange(size - 1)
+        first.append(p1)
+        second.append(p2 if p2 < p1 else p2 + 1)
+        scores.append(random.choice((0.0, 0.5, 1.0)))
+    start = time.time()
+    rating.bulk_ratings(first, second, scores, size)
+    bulk = time.time() - start
+    ratings = rating.Ratings()
+    start = time.time()
+    for i in xrange(min(sample, matches)):
+        ratings.add_result(first[i], second[i], scores[i])
+    single = (time.time() - start) * matches / min(sample, matches)
+    print "ratings of %d players from %d matches: sec" % (size, matches)
+    print "bulk with numpy, %.2f" % bulk
+    print "match by match (extrapolated), %.2f" % single
+
+
+class Uncached(dict):
+    """ Tournament ID cache, which forgets every ID, so that each
+    construction looks the tournament up in the database. """
+
+    def __setitem__(self, key, value):
+        pass
+
+
+def bench_construct(threads=8, constructions=200):
+    """
+    Compare concurrent Tournament constructions, which look the tournament up
+    in the database every time, as before the tournament ID cache, with
+    constructions of a cached tournament. Each thread constructs handles on
+    its own connection.
+    :param threads: The number of concurrent threads.
+    :param constructions: The number of constructions per thread.
+    :return:
+    """
+    conn = bench_connect()
+    Tournament(conn, BENCH_TOURNAMENT)
+    conn.close()
+    tournament_ids = legacy._tournament_ids
+    print "Tournament, %d threads: constructions/sec, p50 msec, p99 msec, " \
+          "statements/construction" % threads
+    for mode in ("lookup", "cached"):
+        if mode == "lookup":
+            legacy._tournament_ids = Uncached()
+        latencies = []
+
+        def construct():
+            conn = bench_connect()
+            times = []
+            for i in xrange(constructions):
+                start = time.time()
+                Tournament(conn, BENCH_TOURNAMENT)
+                times.append(time.time() - start)
+            conn.close()
+            latencies.extend(times)
+        workers = [threading.Thread(target=construct)
+                   for i in xrange(threads)]
+        CountingCursor.statements = 0
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall = time.time() - start
+        legacy._tournament_ids = tournament_ids
+        latencies.sort()
+        print "%s, %.1f, %.3f, %.3f, %.2f" % (
+            mode, len(latencies) / wall, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000,
+            float(CountingCursor.statements) / len(latencies))
+
+
+class Recorder(object):
+    """ Latencies and statements of the operations of a simulation. """
+
+    def __init__(self):
+        """
+        Constructor of Recorder class.
+        :return:
+        """
+        self.latencies = {}
+        self.statements = {}
+        self.order = []
+
+    def measure(self, operation, function, *args):
+        """
+        Call the function and record its latency and statements.
+        :param operation: Name of the operation.
+        :param function: Function to call.
+        :param args: Arguments of the function.
+        :return: The return value of the function.
+        """
+        if operation not in self.latencies:
+            self.latencies[operation] = []
+            self.statements[operation] = 0
+            self.order.append(operation)
+        statements = CountingCursor.statements
+        start = time.time()
+        result = function(*args)
+        self.latencies[operation].append(time.time() - start)
+        self.statements[operation] += CountingCursor.statements - statements
+        return result
+
+    def report(self, title, wall):
+        """
+        Print latency percentiles and statements per operation.
+        :param title: Title of the report.
+        :param wall: Total wall time of the simulation in seconds.
+        :return:
+        """
+        print "%s: total %.2f sec" % (title, wall)
+        print "operation, calls, p50 msec, p90 msec, p99 msec, max msec, " \
+              "statements/call"
+        for operation in self.order:
+            latencies = sorted(self.latencies[operation])
+            calls = len(latencies)
+            print "%s, %d, %.2f, %.2f, %.2f, %.2f, %.1f" % (
+                operation, calls, percentile(latencies, 50) * 1000,
+                percentile(latencies, 90) * 1000,
+                percentile(latencies, 99) * 1000, latencies[-1] * 1000,
+                float(self.statements[operation]) / calls)
+
+
+def percentile(values, p):
+    """
+    Get the percentile of sorted values by the nearest rank.
+    :param values: Sorted list of values.
+    :param p: Percentile between 0 and 100.
+    :return: The value at the percentile.
+    """
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+def simulate_class(players, rounds, draw_rate):
+    """
+    Simulate a Swiss event through the Tournament class.
+    :param players: The number of players.
+    :param rounds: The number of rounds.
+    :param draw_rate: Probability of a match being drawn.
+    :return:
+    """
+    recorder = Recorder()
+    start = time.time()
+    tournament = recorder.measure("Tournament", Tournament, bench_connect(),
+                                  BENCH_TOURNAMENT)
+    recorder.measure("delete_matches", tournament.delete_matches)
+    recorder.measure("delete_players", tournament.delete_players)
+    for i in xrange(players):
+        p_id = "bench.player.%d@udacity.com" % i
+        recorder.measure("register_player", tournament.register_player,
+                         p_id, "Bench Player %d" % i)
+        recorder.measure("participate", tournament.participate, p_id)
+    for round in xrange(rounds):
+        pairings = recorder.measure("swiss_pairings",
+                                    tournament.swiss_pairings)
+        for pairing in pairings:
+            if len(pairing) == 2:
+                recorder.measure("report_bye", tournament.report_bye,
+                                 pairing[0])
+            else:
+                recorder.measure("report_match", tournament.report_match,
+                                 pairing[0], pairing[2],
+                                 random.random() < draw_rate)
+        recorder.measure("player_standings", tournament.player_standings)
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.close()
+    recorder.report("Tournament class, %d players, %d rounds" %
+                    (players, rounds), time.time() - start)
+
+
+def bench_scoring(players=4096, rounds=11, draw_rate=0.3):
+    """
+    Simulate large Swiss events with a mix of wins, draws and byes under
+    each scoring system, and report the operations, which read or update
+    the scores.
+    :param players: The number of players.
+    :param rounds: The number of rounds.
+    :param draw_rate: Probability of a match being drawn.
+    :return:
+    """
+    tournament = Tournament(bench_connect(), BENCH_TOURNAMENT)
+    for name, scoring in (("wins", legacy.WINS), ("chess", legacy.CHESS),
+                          ("football", legacy.FOOTBALL)):
+        tournament.delete_matches()
+        tournament.delete_players()
+        tournament.set_scoring(scoring)
+        tournament.register_players(("bench.player.%d@udacity.com" % i,
+                                     "Bench Player %d" % i)
+                                    for i in xrange(players))
+        recorder = Recorder()
+        start = time.time()
+        for round in xrange(rounds):
+            pairings = recorder.measure("swiss_pairings",
+                                        tournament.swiss_pairings)
+            results = []
+            for pairing in pairings:
+                if len(pairing) == 4:
+                    p1, p2 = pairing[0], pairing[2]
+                    if random.random() < 0.5:
+                        p1, p2 = p2, p1
+                    results.append((p1, p2, random.random() < draw_rate))
+            recorder.measure("report_round", tournament.report_round,
+                             results, pairings)
+            recorder.measure("player_standings", tournament.player_standings)
+        recorder.report("%s scoring, %d players, %d rounds" %
+                        (name, players, rounds), time.time() - start)
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.set_scoring(legacy.WINS)
+    tournament.close()
+
+
+def simulate_legacy(players, rounds):
+    """
+    Simulate a Swiss event through the legacy function API. The legacy API
+    has neither draws nor byes, so draws are not simulated and the player
+    without opponent sits out. This clears the default tournament.
+    :param players: The number of players.
+    :param rounds: The number of rounds.
+    :return:
+    """
+    legacy.close_tournaments()
+    legacy.get_pool(cursor_factory=CountingCursor)
+    recorder = Recorder()
+    start = time.time()
+    recorder.measure("deleteMatches", legacy.deleteMatches)
+    recorder.measure("deletePlayers", legacy.deletePlayers)
+    for i in xrange(players):
+        recorder.measure("registerPlayer", legacy.registerPlayer,
+                         "Bench Player %d" % i)
+    for round in xrange(rounds):
+        pairings = recorder.measure("swissPairings", legacy.swissPairings)
+        for pairing in pairings:
+            if len(pairing) == 4:
+                recorder.measure("reportMatch", legacy.reportMatch,
+                                 pairing[0], pairing[2])
+        recorder.measure("playerStandings", legacy.playerStandings)
+    legacy.deleteMatches()
+    legacy.deletePlayers()
+    legacy.close_tournaments()
+    recorder.report("legacy API, %d players, %d rounds" % (players, rounds),
+                    time.time() - start)
+
+
+def bench_simulate(players=256, rounds=8, draw_rate=0.1, api="both"):
+    """
+    Simulate a full Swiss event and report each operation.
+    :param players: The number of players.
+    :param rounds: The number of rounds.
+    :param draw_rate: Probability of a match being drawn.
+    :param api: "class", "legacy" or "both".
+    :return:
+    """
+    if api in ("class", "both"):
+        simulate_class(players, rounds, draw_rate)
+    if api in ("legacy", "both"):
+        simulate_legacy(players, rounds)
+
+
+BENCHMARKS = {
+    "simulate": None,
+    "standings": bench_standings,
+    "report_match": bench_report_match,
+    "report_round": bench_report_round,
+    "pairing": bench_pairing,
+    "tiebreaks": bench_tiebreaks,
+    "ratings": bench_ratings,
+    "construct": bench_construct,
+    "scoring": bench_scoring,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tournament module.")
+    parser.add_argument("benchmarks", nargs="*", default=["simulate"],
+                        help="benchmarks to run, out of %s (default: "
+                             "simulate)" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument("--players", type=int, default=256,
+                        help="players of the simulated event")
+    parser.add_argument("--rounds", type=int, default=8,
+                        help="rounds of the simulated event")
+    parser.add_argument("--draw-rate", type=float, default=0.1,
+                        help="probability of a simulated draw")
+    parser.add_argument("--api", choices=("class", "legacy", "both"),
+                        default="both", help="API of the simulated event")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark, %s" % name)
+    for name in args.benchmarks:
+        if name == "simulate":
+            bench_simulate(args.players, args.rounds, args.draw_rate,
+                           args.api)
+        else:
+            BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+-- Schema migration for the tournament project.
+--
+-- Upgrade an existing tournament database to the schema of tournament.sql
+-- without dropping any data. Every step can be run more than once, so this is
+-- safe to run against a database, which is already up to date.
+--
+-- Connect to tournament database by "\c tournament" and perform
+-- "\i tournament_migration.sql".
+
+begin;
+
+-- Match IDs are allocated by matches_id_seq instead of select max(id).
+create sequence if not exists matches_id_seq owned by matches.id;
+select setval('matches_id_seq', coalesce(max(id), 0) + 1, false) from matches;
+alter table matches alter column id set default nextval('matches_id_seq');
+alter table matches alter column id set not null;
+
+-- Cached standings and pairings are keyed by the result version.
+alter table tournaments add column if not exists
+    version bigint not null default 0;
+alter table tournaments add column if not exists
+    reset_version bigint not null default 0;
+
+-- Scoring systems. The defaults are the points, which matches have been
+-- stored with: one for a win or a bye and none for a draw or a loss.
+alter table tournaments add column if not exists
+    win_points smallint not null default 1;
+alter table tournaments add column if not exists
+    draw_points smallint not null default 0;
+alter table tournaments add column if not exists
+    loss_points smallint not null default 0;
+alter table tournaments add column if not exists
+    bye_points smallint not null default 1;
+
+-- Matches are numbered by round. The round of an existing match is the round
+-- after the last one either player had played, like report_match infers it.
+alter table matches add column if not exists round integer;
+update matches set round = numbered.round
+from (select t_id, id, max(n) as round
+      from (select t_id, id, row_number() over
+            (partition by t_id, p_id order by id) as n from matches) as rows
+      group by t_id, id) as numbered
+where matches.round is null and matches.t_id = numbered.t_id
+    and matches.id = numbered.id;
+
+-- The per-tournament standings_<id> views are replaced by the standings table,
+-- which is read by one parameterized query for every tournament.
+do $$
+declare
+    standings_view record;
+begin
+    for standings_view in select viewname from pg_views
+            where schemaname = current_schema()
+            and viewname ~ '^standings_[0-9]+$' loop
+        execute format('drop view %I', standings_view.viewname);
+    end loop;
+end
+$$;
+
+create table if not exists standings (
+    t_id integer,
+    p_id text,
+    wins integer not null default 0,
+    losses integer not null default 0,
+    matches integer not null default 0,
+    opponents text[] not null default '{}',
+    tiebreak integer not null default 0,
+    byes integer not null default 0,
+    primary key (t_id, p_id),
+    foreign key (t_id, p_id) references participants (t_id, p_id)
+        on delete cascade
+);
+alter table standings add column if not exists byes integer not null default 0;
+alter table standings add column if not exists
+    version bigint not null default 0;
+
+-- Withdrawn players keep their results, but are left out of the standings
+-- and pairings.
+alter table participants add column if not exists
+    withdrawn boolean not null default false;
+alter table standings add column if not exists
+    withdrawn boolean not null default false;
+
+-- Standings are ranked by score. wins used to be the sum of the points, which
+-- is the score with the default scoring system.
+alter table standings add column if not exists
+    score integer not null default 0;
+update standings set score = wins where score = 0 and wins > 0;
+
+-- Standings of participants, who have none yet, are built from matches like
+-- Tournament.rebuild_standings() does.
+insert into standings (t_id, p_id, wins, losses, matches, score, opponents,
+                       byes)
+select participants.t_id, participants.p_id,
+       sum(case when matches.points > opponent.points or
+           (matches.id is not null and opponent.p_id is null)
+           then 1 else 0 end),
+       sum(case when matches.points < opponent.points then 1 else 0 end),
+       count(matches.id),
+       coalesce(sum(matches.points), 0),
+       array_remove(array_agg(opponent.p_id), null),
+       count(matches.id) - count(opponent.p_id)
+from participants
+left join matches on matches.t_id = participants.t_id
+    and matches.p_id = participants.p_id
+left join matches as opponent on opponent.t_id = matches.t_id
+    and opponent.id = matches.id and opponent.p_id <> matches.p_id
+group by participants.t_id, participants.p_id
+on conflict (t_id, p_id) do nothing;
+
+update standings set tiebreak = coalesce((select sum(opponent.score)
+    from unnest(standings.opponents) as played (p_id)
+    join standings as opponent on opponent.t_id = standings.t_id
+    and opponent.p_id = played.p_id), 0);
+
+-- Ratings of the players. Run "python rating.py" after the migration to
+-- compute them from the existing matches.
+create table if not exists ratings (
+    p_id text primary key references players (id) on delete cascade,
+    elo double precision not null default 1500,
+    glicko double precision not null default 1500,
+    glicko_rd double precision not null default 350,
+    glicko_volatility double precision not null default 0.06,
+    matches integer not null default 0
+);
+
+-- matches used to be keyed by (id, t_id, p_id), so lookups by tournament
+-- could not use the primary key. t_id leads the key now.
+alter table matches drop constraint if exists matches_pkey;
+alter table matches add primary key (t_id, id, p_id);
+
+create index if not exists matches_player_idx
+    on matches (t_id, p_id, id, points);
+create index if not exists matches_p_id_idx on matches (p_id);
+create index if not exists matches_round_idx on matches (t_id, round);
+create index if not exists participants_p_id_idx on participants (p_id);
+create index if not exists participants_active_idx
+    on participants (t_id, p_id) where not withdrawn;
+-- standings_order_idx is by score and covers only the players, who have not
+-- withdrawn.
+drop index if exists standings_order_idx;
+create index standings_order_idx
+    on standings (t_id, score desc, tiebreak desc) where not withdrawn;
+create index if not exists standings_version_idx
+    on standings (t_id, version);
+
+commit;
+
+analyze matches;
+analyze participants;
+analyze standings;
@@ -3,9 +3,44 @@
 Test cases for tournament.py
 """
 
+import itertools
+import json
+import logging
+import random
+import threading
+from StringIO import StringIO
+
+import psycopg2
+import psycopg2.extensions
+
+import rating
+import tiebreak
+import tournament as legacy
+from cache import StandingsCache
+from export import export_standings
+from instrument import Instrument
+from memory import MemoryTournament
+from service import TournamentService
 from tournament import *
 
 
+class ExplainCursor(psycopg2.extensions.cursor):
+    """ Cursor, which fails queries planned with a sequential scan. """
+
+    def execute(self, query, vars=None):
+        statement = query.lstrip().lower()
+        if statement.startswith(("select", "update", "delete", "with",
+                                 "execute")) and \
+                "pg_advisory_xact_lock" not in statement:
+            super(ExplainCursor, self).execute(
+                "explain (format json) " + query, vars)
+            plan = json.dumps(self.fetchone()[0])
+            if '"Seq Scan"' in plan:
+                raise ValueError("Sequential scan in hot query: %s" %
+                                 " ".join(query.split()))
+        return super(ExplainCursor, self).execute(query, vars)
+
+
 def testDeleteMatches():
     """ test deleteMatches. """
     deleteMatches()
@@ -304,6 +339,844 @@ def test_pairing(tournament):
     print "108. After one match, players with one win are paired."
 
 
+
+def test_iter_standings(tournament):
+    """
+    Test iter_player_standings() returns the same rows as player_standings().
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    for i in xrange(10):
+        p_id = "iter.player.%d@gmail.com" % i
+        tournament.register_player(p_id, "Iter Player %d" % i)
+        tournament.participate(p_id)
+    standings = tournament.player_standings()
+    tournament.report_match(standings[0][0], standings[1][0])
+    standings = tournament.player_standings()
+    streamed = list(tournament.iter_player_standings(itersize=3))
+    if sorted(streamed) != sorted(standings):
+        raise ValueError(
+            "iter_player_standings should return the same rows as "
+            "player_standings.")
+    print "109. Streamed standings match player_standings()."
+
+
+def test_rebuild_standings(tournament):
+    """
+    Test rebuild_standings() restores the standings maintained by
+    report_match().
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    for i in xrange(8):
+        p_id = "rebuild.player.%d@gmail.com" % i
+        tournament.register_player(p_id, "Rebuild Player %d" % i)
+        tournament.participate(p_id)
+    for pairing in tournament.swiss_pairings():
+        tournament.report_match(pairing[0], pairing[2])
+    for pairing in tournament.swiss_pairings():
+        tournament.report_match(pairing[2], pairing[0])
+    standings = tournament.player_standings()
+    tournament.rebuild_standings()
+    if sorted(tournament.player_standings()) != sorted(standings):
+        raise ValueError(
+            "rebuild_standings should restore the standings of report_match.")
+    print "110. Standings can be rebuilt from matches."
+
+
+def test_concurrent_report_matches(tournament, threads=16, matches=50):
+    """
+    Test report_match() from many connections at once. Every match should get
+    its own ID and the standings should agree with the matches table.
+    :param tournament: Tournament.
+    :param threads: The number of concurrent reporters.
+    :param matches: The number of matches each reporter reports.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    players = []
+    for i in xrange(threads):
+        p_id = "stress.player.%d@gmail.com" % i
+        tournament.register_player(p_id, "Stress Player %d" % i)
+        tournament.participate(p_id)
+        players.append(p_id)
+    errors = []
+
+    def reporter():
+        reporter_tournament = Tournament(connect(), tournament.t_name)
+        try:
+            for i in xrange(matches):
+                winner, loser = random.sample(players, 2)
+                reporter_tournament.report_match(winner, loser)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            reporter_tournament.close()
+
+    workers = [threading.Thread(target=reporter) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise ValueError("Concurrent report_match failed: %s" % errors[0])
+    tournament.cur.execute("select count(*), count(distinct id) from matches \
+                            where t_id = %s;", (tournament.t_id, ))
+    rows, ids = tournament.cur.fetchone()
+    if ids != threads * matches or rows != 2 * ids:
+        raise ValueError("Each reported match should have its own ID.")
+    standings = tournament.player_standings()
+    tournament.rebuild_standings()
+    if sorted(tournament.player_standings()) != sorted(standings):
+        raise ValueError(
+            "Concurrent report_match should keep standings consistent.")
+    print "111. Matches can be reported concurrently."
+
+
+def test_report_round(tournament):
+    """
+    Test report_round() validates the results against the pairings and
+    updates the standings of the whole round.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    for i in xrange(8):
+        p_id = "round.player.%d@gmail.com" % i
+        tournament.register_player(p_id, "Round Player %d" % i)
+        tournament.participate(p_id)
+    pairings = tournament.swiss_pairings()
+    results = [(pairing[0], pairing[2]) for pairing in pairings]
+    try:
+        tournament.report_round(results[1:], pairings)
+        raise AssertionError("report_round should reject a partial round.")
+    except ValueError:
+        tournament.conn.rollback()
+    results[0] = (results[0][0], results[0][1], True)
+    if tournament.report_round(results, pairings) != 4:
+        raise ValueError("report_round should report four matches.")
+    standings = tournament.player_standings()
+    if set(m for (i, n, w, m) in standings) != set([1]):
+        raise ValueError("Each player should have one match recorded.")
+    if sum(w for (i, n, w, m) in standings) != 3:
+        raise ValueError("A draw should not be recorded as a win.")
+    print "112. A round of results can be reported at once."
+
+
+def test_register_players(tournament):
+    """
+    Test register_players() inserts new participants and skips existing ones.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_player("markov.chaney@gmail.com", "Markov Chaney")
+    tournament.participate("markov.chaney@gmail.com")
+    rows = [("markov.chaney@gmail.com", "Markov Chaney"),
+            ("joe.malik@gmail.com", "Joe Malik"),
+            ("mao.tsu-hsi@gmail.com", "Mao Tsu-hsi"),
+            ("joe.malik@gmail.com", "Joe Malik")]
+    inserted, skipped = tournament.register_players(rows)
+    if (inserted, skipped) != (2, 2):
+        raise ValueError("register_players should insert two players and "
+                         "skip two rows.")
+    if tournament.count_players() != 3:
+        raise ValueError(
+            "After importing players, count_players should be 3.")
+    if len(tournament.player_standings()) != 3:
+        raise ValueError("Imported players should appear in standings.")
+    print "113. Players can be imported in bulk."
+
+
+def test_pairing_odd_players(tournament):
+    """
+    Test swiss_pairings() with an odd number of players gives a bye to a
+    different player every round and avoids rematches.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    for i in xrange(5):
+        p_id = "odd.player.%d@gmail.com" % i
+        tournament.register_player(p_id, "Odd Player %d" % i)
+        tournament.participate(p_id)
+    played = set()
+    byes = set()
+    for round in xrange(5):
+        pairings = tournament.swiss_pairings()
+        if [len(pairing) for pairing in pairings] != [4, 4, 2]:
+            raise ValueError("For five players, swiss_pairings should return "
+                             "two pairs and a bye.")
+        for pairing in pairings[:2]:
+            pair = frozenset([pairing[0], pairing[2]])
+            if pair in played:
+                raise ValueError("Players should not be paired twice.")
+            played.add(pair)
+        if pairings[2][0] in byes:
+            raise ValueError("A player should not get a second bye.")
+        byes.add(pairings[2][0])
+        tournament.report_round([(pairing[0], pairing[2])
+                                 for pairing in pairings[:2]], pairings)
+    standings = tournament.player_standings()
+    if set(m for (i, n, w, m) in standings) != set([5]):
+        raise ValueError("Byes should be counted as played matches.")
+    print "114. With odd players, byes rotate and rematches are avoided."
+
+
+def test_tiebreaks(tournament):
+    """
+    Test player_standings() orders players with the same wins by the given
+    tiebreaks, and the cached tiebreaks follow new results.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    players = ["a", "b", "c", "d"]
+    for p_id in players:
+        tournament.register_player("tiebreak.%s@gmail.com" % p_id,
+                                   "Tiebreak %s" % p_id.upper())
+        tournament.participate("tiebreak.%s@gmail.com" % p_id)
+    a, b, c, d = ["tiebreak.%s@gmail.com" % p_id for p_id in players]
+    tournament.report_match(a, b)
+    tournament.report_match(c, d)
+    tournament.report_match(a, c)
+    tournament.report_match(d, b)
+    for name in (tiebreak.BUCHHOLZ, tiebreak.SONNEBORN_BERGER):
+        standings = tournament.player_standings(tiebreaks=[name])
+        if [row[0] for row in standings] != [a, c, d, b]:
+            raise ValueError("Players with the same wins should be ordered "
+                             "by %s." % name)
+    tournament.report_match(b, c)
+    cached = tournament.tiebreaks()
+    tournament.rebuild_standings()
+    loaded = tournament.tiebreaks()
+    for p_id in (a, b, c, d):
+        if cached.get(p_id) != loaded.get(p_id):
+            raise ValueError("Cached tiebreaks should follow new results.")
+    print "115. Tiebreaks order players with the same wins."
+
+
+def test_memory_tournament(tournament):
+    """
+    Test MemoryTournament persists its changes to the database and recovers
+    them on startup.
+    :param tournament: Tournament.
+    :return:
+    """
+    memory = MemoryTournament(connect(), tournament.t_name)
+    memory.delete_matches()
+    memory.delete_players()
+    for i in xrange(7):
+        p_id = "memory.player.%d@gmail.com" % i
+        memory.register_player(p_id, "Memory Player %d" % i)
+        memory.participate(p_id)
+    for round in xrange(3):
+        pairings = memory.swiss_pairings()
+        memory.report_round([(pairing[0], pairing[2])
+                             for pairing in pairings if len(pairing) == 4],
+                            pairings)
+    standings = memory.player_standings()
+    memory.close()
+    if memory.errors:
+        raise ValueError("MemoryTournament failed to persist: %s" %
+                         memory.errors[0][2])
+    if sorted(tournament.player_standings()) != sorted(standings):
+        raise ValueError("MemoryTournament should persist its standings.")
+    memory = MemoryTournament(connect(), tournament.t_name)
+    if sorted(memory.player_standings()) != sorted(standings):
+        raise ValueError("MemoryTournament should recover its standings.")
+    try:
+        memory.report_bye("memory.unknown@gmail.com")
+        raise AssertionError("A bye should be only for participants.")
+    except ValueError:
+        pass
+    memory.close()
+    print "116. In-memory tournaments are persisted and recovered."
+
+
+def test_hot_queries_use_indexes(tournament):
+    """
+    Test the queries of the round loop are planned without sequential scans.
+    Sequential scans are disabled, so the planner still chooses one only if
+    no index can serve the query.
+    :param tournament: Tournament.
+    :return:
+    """
+    conn = psycopg2.connect(DSN, cursor_factory=ExplainCursor)
+    conn.cursor().execute("set enable_seqscan = off;")
+    conn.commit()
+    explained = Tournament(conn, tournament.t_name)
+    explained.delete_matches()
+    explained.delete_players()
+    explained.register_players([("explain.player.%d@gmail.com" % i,
+                                 "Explain Player %d" % i) for i in xrange(8)])
+    explained.count_players()
+    pairings = explained.swiss_pairings()
+    explained.report_match(pairings[0][0], pairings[0][2])
+    explained.report_matches([(pairing[0], pairing[2])
+                              for pairing in pairings[1:]])
+    explained.player_standings(tiebreaks=[tiebreak.BUCHHOLZ])
+    explained.delete_matches()
+    explained.delete_players()
+    explained.close()
+    print "117. Hot queries are planned with indexes."
+
+
+def play_event(tournament, players, rounds):
+    """
+    Play a small event from scratch on the tournament.
+    :param tournament: Tournament.
+    :param players: The number of players.
+    :param rounds: The number of rounds.
+    :return: The standings after the last round.
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_players([("service.player.%d@gmail.com" % i,
+                                  "Service Player %d" % i)
+                                 for i in xrange(players)])
+    for round in xrange(rounds):
+        pairings = tournament.swiss_pairings()
+        tournament.report_round([(pairing[0], pairing[2])
+                                 for pairing in pairings
+                                 if len(pairing) == 4], pairings)
+    return tournament.player_standings()
+
+
+def test_service(tournament, events=8):
+    """
+    Test TournamentService hosts more tournaments at once than it has
+    connections.
+    :param tournament: Tournament.
+    :param events: The number of tournaments played at once.
+    :return:
+    """
+    service = TournamentService(maxconn=3, workers=events)
+    futures = [service.submit("%s %d" % (tournament.t_name, i), play_event,
+                              6 + i, 3) for i in xrange(events)]
+    for i, future in enumerate(futures):
+        standings = future.result(60)
+        if len(standings) != 6 + i or \
+                set(m for (p, n, w, m) in standings) != set([3]):
+            raise ValueError("Each hosted tournament should play its rounds.")
+    for i in xrange(events):
+        service.call("%s %d" % (tournament.t_name, i),
+                     Tournament.delete_matches)
+        service.call("%s %d" % (tournament.t_name, i),
+                     Tournament.delete_players)
+    service.close()
+    print "118. Many tournaments can be hosted at once."
+
+
+def test_standings_cache(tournament):
+    """
+    Test cached standings are reused until a result is reported, also by
+    another handle of the same tournament.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_players(("cache.player.%d@gmail.com" % i,
+                                 "Cache Player %d" % i) for i in xrange(4))
+    cache = StandingsCache()
+    reader = Tournament(connect(), tournament.t_name, cache)
+    standings = reader.player_standings()
+    if reader.player_standings() != standings or cache.hits != 1 or \
+            cache.misses != 1:
+        raise ValueError("Standings should be cached between results.")
+    reader.swiss_pairings()
+    if reader.swiss_pairings() != reader.swiss_pairings() or cache.hits != 3:
+        raise ValueError("Pairings should be cached between results.")
+    tournament.report_match(standings[0][0], standings[1][0])
+    standings = reader.player_standings()
+    if cache.misses != 3 or standings[0][2] != 1:
+        raise ValueError("Reporting a result should invalidate the cache.")
+    tournament.delete_matches()
+    if reader.player_standings()[0][2] != 0:
+        raise ValueError("Deleting matches should invalidate the cache.")
+    tournament.delete_players()
+    if reader.player_standings():
+        raise ValueError("Deleting players should invalidate the cache.")
+    reader.close()
+    print "119. Standings are cached until the results change."
+
+
+def test_rounds(tournament):
+    """
+    Test matches are numbered by round, and standings and pairings can be
+    read as of an earlier round.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_players(("round.history.%d@gmail.com" % i,
+                                 "Round History %d" % i) for i in xrange(5))
+    played = []
+    for i in xrange(3):
+        pairings = tournament.swiss_pairings()
+        played.append(pairings)
+        tournament.report_round([(p[0], p[2]) for p in pairings
+                                 if len(p) == 4], pairings)
+        standings = tournament.player_standings()
+    if tournament.current_round() != 3:
+        raise ValueError("Three rounds should be recorded.")
+    for i, pairings in enumerate(played):
+        if sorted(tournament.round_pairings(i + 1)) != sorted(pairings):
+            raise ValueError("Pairings of a round should be kept.")
+    if tournament.player_standings_as_of(3) != standings:
+        raise ValueError("Standings of the last round should be current.")
+    first = tournament.player_standings_as_of(1)
+    if sorted(w for (p, n, w, m) in first) != [0, 0, 1, 1, 1] or \
+            set(m for (p, n, w, m) in first) != set([1]):
+        raise ValueError("Standings after round 1 should have one match.")
+    history = tournament.history()
+    pairings = played[0]
+    if not history.have_met(pairings[0][0], pairings[0][2]) or \
+            not history.had_bye(pairings[-1][0]):
+        raise ValueError("Opponent history should have the matches.")
+    tournament.report_match(pairings[0][0], pairings[0][2], round=4)
+    if tournament.current_round() != 4:
+        raise ValueError("An explicit round should be recorded.")
+    print "120. Standings and pairings can be read as of any round."
+
+
+def test_ratings(tournament):
+    """
+    Test reported matches update the ratings of the players, and the same
+    ratings are computed from the history of matches.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    p_ids = ["rating.player.%d@gmail.com" % i for i in xrange(3)]
+    tournament.register_players((p_id, p_id) for p_id in p_ids)
+    tournament.cur.execute("delete from ratings where p_id = any(%s);",
+                           (p_ids, ))
+    tournament.conn.commit()
+    tournament.report_match(p_ids[0], p_ids[1])
+    tournament.report_matches([(p_ids[0], p_ids[2]), (p_ids[1], p_ids[2],
+                                                      True)])
+    expected = rating.Ratings()
+    expected.add_result(p_ids[0], p_ids[1], 1)
+    expected.add_result(p_ids[0], p_ids[2], 1)
+    expected.add_result(p_ids[1], p_ids[2], 0.5)
+    for system, column in ((rating.ELO, 0), (rating.GLICKO2, 1)):
+        ratings = tournament.player_ratings(system)
+        if [row[0] for row in ratings] != sorted(
+                p_ids, key=lambda p_id: -expected.get(p_id)[column]):
+            raise ValueError("Players should be ordered by %s." % system)
+        for p_id, name, value, matches in ratings:
+            if abs(value - expected.get(p_id)[column]) > 0.000001 or \
+                    matches != 2:
+                raise ValueError("Ratings should be updated by results.")
+    print "121. Ratings are updated by reported matches."
+
+
+def test_glicko2_volatility():
+    """
+    Test the Glicko-2 volatility against reference values, including an
+    upset, for which the improvement exceeds the variance of the rating, and
+    stays stable for players, who keep alternating results.
+    :return:
+    """
+    # Reference values by bisection of the volatility function of Glickman's
+    # "Example of the Glicko-2 system".
+    if abs(rating._volatility(0.5, 0.06, 2.0, 3.0) - 0.0600179) > 0.000001:
+        raise ValueError("Volatility should be the root of its function.")
+    new = rating.glicko2_update((1500, 50, 0.06), (2300, 50, 0.06), 1)
+    for value, expected in zip(new, (1514.663, 51.053, 0.0600127)):
+        if abs(value - expected) > 0.001:
+            raise ValueError("An upset should change the rating by %.3f, "
+                             "not %.3f." % (expected - 1500, new[0] - 1500))
+    player1, player2 = (1500, 200, 0.06), (1520, 200, 0.06)
+    for i in xrange(20):
+        score = i % 2
+        player1, player2 = rating.glicko2_update(player1, player2, score), \
+            rating.glicko2_update(player2, player1, 1 - score)
+    if not 0.059 < player1[2] < 0.061 or not 0.059 < player2[2] < 0.061:
+        raise ValueError("Alternating results should keep the volatility.")
+    print "127. Glicko-2 volatility matches the reference values."
+
+
+def test_bulk_ratings(players=50, matches=2000):
+    """
+    Test bulk_ratings() computes the same ratings as Ratings replaying a
+    random history in the same order. Skipped without NumPy.
+    :param players: The number of players.
+    :param matches: The number of matches.
+    :return:
+    """
+    try:
+        import numpy
+    except ImportError:
+        print "130. Bulk ratings are skipped without NumPy."
+        return
+    generator = random.Random(130)
+    first, second, scores = [], [], []
+    ratings = rating.Ratings()
+    for i in xrange(matches):
+        p1, p2 = generator.sample(xrange(players), 2)
+        score = generator.choice((0, 0.5, 1))
+        first.append(p1)
+        second.append(p2)
+        scores.append(score)
+        ratings.add_result(p1, p2, score)
+    bulk = numpy.column_stack(rating.bulk_ratings(first, second, scores,
+                                                  players))
+    for p_id in xrange(players):
+        for value, expected in zip(bulk[p_id], ratings.get(p_id)):
+            if abs(value - expected) > 1e-6 * max(1, abs(expected)):
+                raise ValueError("Bulk ratings of %d should be %s, not %s." %
+                                 (p_id, ratings.get(p_id),
+                                  bulk[p_id].tolist()))
+    print "130. Bulk ratings match the ratings replayed match by match."
+
+
+def test_concurrent_legacy_calls(threads=8, matches=50):
+    """
+    Test reportMatch() from many threads at once. The threads share the
+    cached handle of the default tournament, and no reported match should
+    be lost.
+    :param threads: The number of concurrent reporters.
+    :param matches: The number of matches each reporter reports.
+    :return:
+    """
+    deleteMatches()
+    deletePlayers()
+    for i in xrange(threads):
+        registerPlayer("Legacy Player %d" % i)
+    players = [row[0] for row in playerStandings()]
+    errors = []
+
+    def reporter():
+        try:
+            for i in xrange(matches):
+                winner, loser = random.sample(players, 2)
+                reportMatch(winner, loser)
+                playerStandings()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=reporter) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise ValueError("Concurrent reportMatch failed: %s" % errors[0])
+    if sum(row[3] for row in playerStandings()) != 2 * threads * matches:
+        raise ValueError("Every match reported by the threads should be "
+                         "stored.")
+    print "128. Legacy functions can be called from many threads."
+
+
+def test_scoring_tiebreaks(tournament):
+    """
+    Test the tiebreaks are computed from the points of the scoring system of
+    the tournament, so that they agree with the scores.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.set_scoring(FOOTBALL)
+    a, b, c, d = p_ids = ["scoring.tiebreak.%s@gmail.com" % p_id
+                          for p_id in "abcd"]
+    tournament.register_players((p_id, p_id) for p_id in p_ids)
+    tournament.report_match(a, b, round=1)
+    tournament.report_match(c, d, True, round=1)
+    tournament.report_match(a, c, round=2)
+    tournament.report_match(b, d, round=2)
+    # Scores are a 6, b 3, c 1 and d 1.
+    expected = {a: (4, 4, 0.5 * (0.5 + 1.0 / 3)),
+                b: (7, 1, 0.5 * (1 + 1.0 / 3)),
+                c: (7, 1.0 / 3, 0.5 * (1.0 / 3 + 1)),
+                d: (4, 1.0 / 3, 0.5 * (1.0 / 3 + 0.5))}
+    tournament.cur.execute("select p_id, tiebreak from standings where \
+                            t_id = %s;", (tournament.t_id, ))
+    column = dict(tournament.cur.fetchall())
+    names = (tiebreak.BUCHHOLZ, tiebreak.SONNEBORN_BERGER, tiebreak.OMW)
+    memory = MemoryTournament(connect(), tournament.t_name)
+    for engine in (tournament.tiebreaks(), memory.tiebreaks()):
+        for p_id in p_ids:
+            values = engine.get(p_id, names)
+            if any(abs(value - e) > 0.000001
+                   for value, e in zip(values, expected[p_id])) or \
+                    values[0] != column[p_id]:
+                raise ValueError("Tiebreaks of %s should be %r, not %r." %
+                                 (p_id, expected[p_id], values))
+    memory.close()
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.set_scoring(WINS)
+    print "129. Tiebreaks are computed by the scoring system."
+
+
+def test_export(tournament):
+    """
+    Test the standings export streams all standings, and then only the
+    standings changed since the previous export.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_players(("export.player.%d@gmail.com" % i,
+                                 "Export Player %d" % i) for i in xrange(6))
+    out = StringIO()
+    header = export_standings(tournament, out, itersize=2)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    if not header["full"] or header["rows"] != 6 or len(lines) != 7 or \
+            lines[0]["version"] != header["version"]:
+        raise ValueError("A full export should have every participant.")
+    winner, loser = lines[1]["id"], lines[2]["id"]
+    tournament.report_match(winner, loser)
+    out = StringIO()
+    changed = export_standings(tournament, out, "csv", header["version"])
+    rows = out.getvalue().splitlines()[1:]
+    if changed["full"] or changed["version"] <= header["version"] or \
+            [row.split(",")[0] for row in rows] != [winner, loser]:
+        raise ValueError("An export since a version should have the "
+                         "changed standings only.")
+    tournament.delete_players()
+    if not export_standings(tournament, StringIO(),
+                            since=changed["version"])["full"]:
+        raise ValueError("Deleted standings should need a full export.")
+    for consumed in (0, 1):
+        rows = tournament.standings_changes(itersize=1)[2]
+        for row in itertools.islice(rows, consumed):
+            pass
+        del rows
+        if tournament.conn.get_transaction_status() != \
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raise ValueError("An abandoned export should end its snapshot.")
+    with legacy.get_tournament(tournament.t_name) as handle:
+        rows = handle.standings_changes()[2]
+    with legacy.get_tournament(tournament.t_name) as handle:
+        handle.cur.execute("select 1;")
+        del rows
+        if handle.conn.get_transaction_status() != \
+                psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            raise ValueError("An export abandoned after its call should not "
+                             "end the transaction of the next call.")
+    print "122. Standings can be exported in full or since a version."
+
+
+class ListHandler(logging.Handler):
+    """ Logging handler, which keeps the records. """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_instrument(tournament):
+    """
+    Test instrumented connections record queries and commits per method and
+    log slow statements with their plan.
+    :param tournament: Tournament.
+    :return:
+    """
+    instrument = Instrument(slow=0)
+    handler = ListHandler()
+    logger = logging.getLogger("instrument")
+    logger.addHandler(handler)
+    instrumented = Tournament(instrument.connect(), tournament.t_name)
+    instrumented.delete_matches()
+    instrumented.delete_players()
+    instrumented.register_players([("instrument.player.%d@gmail.com" % i,
+                                    "Instrument Player %d" % i)
+                                   for i in xrange(2)])
+    instrumented.report_match("instrument.player.0@gmail.com",
+                              "instrument.player.1@gmail.com")
+    instrumented.player_standings()
+    queries, seconds, rows, commits = instrument.stats["report_match"]
+    if queries < 3 or commits != 1 or seconds <= 0:
+        raise ValueError("Queries and commits should be recorded per method.")
+    if instrument.stats["player_standings"][2] != 2:
+        raise ValueError("Rows returned should be recorded.")
+    if 'tournament_commits_total{method="report_match"} 1' not in \
+            instrument.prometheus():
+        raise ValueError("Statistics should be exported for Prometheus.")
+    if not any("Scan" in record.getMessage() for record in handler.records):
+        raise ValueError("Slow statements should be logged with the plan.")
+    logger.removeHandler(handler)
+    instrumented.delete_matches()
+    instrumented.delete_players()
+    instrumented.close()
+    print "123. Queries can be instrumented per method."
+
+
+def test_construct(tournament, threads=8):
+    """
+    Test handles of a known tournament are constructed without queries,
+    concurrent constructions of an uncached tournament get the same ID, and
+    queries are prepared once per connection.
+    :param tournament: Tournament.
+    :param threads: The number of concurrent constructions.
+    :return:
+    """
+    instrument = Instrument(slow=60)
+    handle = Tournament(instrument.connect(), tournament.t_name)
+    if handle.t_id != tournament.t_id or instrument.stats:
+        raise ValueError("A known tournament should be constructed without "
+                         "queries.")
+    handle.version()
+    handle.version()
+    handle.cur.execute("select count(*) from pg_prepared_statements;")
+    if handle.cur.fetchone()[0] != 1 or \
+            instrument.stats["version"][0] != 3:
+        raise ValueError("A query should be prepared once per connection.")
+    handle.close()
+
+    name = "Construction Cup"
+    legacy.forget_tournament_ids()
+    t_ids = []
+    dsns = []
+
+    def construct():
+        conn = connect()
+        t_ids.append(Tournament(conn, name).t_id)
+        dsns.append(conn.dsn)
+        conn.close()
+    workers = [threading.Thread(target=construct) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if len(t_ids) != threads or len(set(t_ids)) != 1 or \
+            legacy._tournament_ids[(dsns[0], name)] != t_ids[0]:
+        raise ValueError("Concurrent constructions should get the same "
+                         "tournament ID.")
+    print "124. Tournament handles can be constructed without queries."
+
+
+def test_withdraw(tournament):
+    """
+    Test a withdrawn player keeps the results, but is left out of the
+    standings and pairings, and a player can be unregistered.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.register_players(("withdraw.player.%d@gmail.com" % i,
+                                 "Withdraw Player %d" % i) for i in xrange(4))
+    pairings = tournament.swiss_pairings()
+    tournament.report_round([(p[0], p[2]) for p in pairings], pairings)
+    before = tournament.player_standings()
+    version = tournament.version()
+    withdrawn = pairings[0][2]
+    tournament.withdraw_player(withdrawn)
+    if tournament.player_standings() != \
+            [row for row in before if row[0] != withdrawn] or \
+            tournament.count_players() != 3:
+        raise ValueError("A withdrawn player should leave the standings "
+                         "only.")
+    pairings = tournament.swiss_pairings()
+    if len(pairings) != 2 or len(pairings[-1]) != 2 or \
+            withdrawn in [p_id for p in pairings for p_id in p[::2]]:
+        raise ValueError("A withdrawn player should not be paired.")
+    try:
+        tournament.report_matches([(pairings[0][0], withdrawn)])
+        raise AssertionError("A withdrawn player should not play.")
+    except ValueError:
+        pass
+    try:
+        tournament.report_match(withdrawn, pairings[0][0])
+        raise AssertionError("A withdrawn player should not play.")
+    except ValueError:
+        pass
+    try:
+        tournament.withdraw_player(withdrawn)
+        raise AssertionError("A player should withdraw only once.")
+    except ValueError:
+        pass
+    if not export_standings(tournament, StringIO(), since=version)["full"]:
+        raise ValueError("Withdrawals should need a full export.")
+    memory = MemoryTournament(connect(), tournament.t_name)
+    if [row[0] for row in memory.player_standings()] != \
+            [row[0] for row in tournament.player_standings()] or \
+            memory.count_players() != 3:
+        raise ValueError("Withdrawals should be loaded into memory.")
+    memory.close()
+    tournament.register_player("withdraw.unregistered@gmail.com",
+                               "Withdraw Unregistered")
+    tournament.unregister_player("withdraw.unregistered@gmail.com")
+    tournament.cur.execute("select id from players where id = %s;",
+                           ("withdraw.unregistered@gmail.com", ))
+    if tournament.cur.fetchone() is not None:
+        raise ValueError("A player should be unregistered.")
+    tournament.delete_matches()
+    tournament.delete_players()
+    print "125. Players can withdraw and keep their results."
+
+
+def test_scoring(tournament):
+    """
+    Test standings are ranked by the points of the scoring system of the
+    tournament, which can be set only before the first match.
+    :param tournament: Tournament.
+    :return:
+    """
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.set_scoring(FOOTBALL)
+    if tournament.scoring() != FOOTBALL:
+        raise ValueError("Scoring should be set.")
+    p_ids = ["scoring.player.%d@gmail.com" % i for i in xrange(5)]
+    tournament.register_players((p_id, "Scoring Player %d" % i)
+                                for i, p_id in enumerate(p_ids))
+    tournament.report_matches([(p_ids[0], p_ids[1], True),
+                               (p_ids[2], p_ids[3])], round=1)
+    tournament.report_bye(p_ids[4], round=1)
+    standings = tournament.player_standings()
+    if set(row[0] for row in standings[:2]) != set([p_ids[4], p_ids[2]]) or \
+            standings[-1][0] != p_ids[3] or \
+            [row[2] for row in standings] != [1, 1, 0, 0, 0]:
+        raise ValueError("A draw should be worth 1 of the 3 points of a win.")
+    tournament.cur.execute("select p_id, score from standings where \
+                            t_id = %s;", (tournament.t_id, ))
+    scores = dict(tournament.cur.fetchall())
+    if [scores[p_id] for p_id in p_ids] != [1, 1, 3, 0, 3]:
+        raise ValueError("Scores should be the sums of the points.")
+    try:
+        tournament.set_scoring(CHESS)
+        raise AssertionError("Scoring should not change after matches.")
+    except ValueError:
+        pass
+    if sorted(tournament.player_standings_as_of(1)) != sorted(standings):
+        raise ValueError("Standings as of a round should use the scoring.")
+    memory = MemoryTournament(connect(), tournament.t_name)
+    if sorted(memory.player_standings()) != sorted(standings):
+        raise ValueError("Standings in memory should use the scoring.")
+    memory.close()
+    tournament.rebuild_standings()
+    tournament.cur.execute("select p_id, score from standings where \
+                            t_id = %s;", (tournament.t_id, ))
+    if dict(tournament.cur.fetchall()) != scores or \
+            sorted(tournament.player_standings()) != sorted(standings):
+        raise ValueError("Rebuilt standings should have the same scores.")
+    tournament.delete_matches()
+    tournament.delete_players()
+    tournament.set_scoring(WINS)
+    print "126. Matches can be scored by a scoring system."
+
 if __name__ == '__main__':
     print "Original tests start."
     testDeleteMatches()
@@ -327,6 +1200,28 @@ if __name__ == '__main__':
     test_standings_before_matches(tournament)
     test_report_matches(tournament)
     test_pairing(tournament)
+    test_iter_standings(tournament)
+    test_rebuild_standings(tournament)
+    test_concurrent_report_matches(tournament)
+    test_report_round(tournament)
+    test_register_players(tournament)
+    test_pairing_odd_players(tournament)
+    test_tiebreaks(tournament)
+    test_memory_tournament(tournament)
+    test_hot_queries_use_indexes(tournament)
+    test_service(tournament)
+    test_standings_cache(tournament)
+    test_rounds(tournament)
+    test_ratings(tournament)
+    test_export(tournament)
+    test_instrument(tournament)
+    test_construct(tournament)
+    test_withdraw(tournament)
+    test_scoring(tournament)
+    test_glicko2_volatility()
+    test_concurrent_legacy_calls()
+    test_scoring_tiebreaks(tournament)
+    test_bulk_ratings()
     tournament.close()
     print "Succeeded with extra test cases with multiple tournaments scenario."
     print "Success!  All tests pass!"
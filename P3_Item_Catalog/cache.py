@@ -0,0 +1,138 @@
+"""
+Category cache
+cache.py -- categories of the catalog cached for every page render.
+
+The same module is in P3_Item_Catalog and P5_Item_Catalog_Postgres, because
+each application directory is deployed on its own, like database_setup.py.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+
+class CachedCategory(namedtuple("CachedCategory",
+                                "id name description user_id")):
+    """ Read-only copy of a category, which is shared by requests. """
+
+    __slots__ = ()
+
+    @property
+    def serialize(self):
+        """Return object data in easily serializeable format"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "id": self.id,
+            "user_id": self.user_id,
+        }
+
+
+class CategoryCache(object):
+    """
+    Categories cached for the pages. Every change of the categories
+    increments the version, and the categories of an older version are not
+    used any more. With a shared werkzeug cache, like MemcachedCache or
+    RedisCache, the processes of a deployment share the version and the
+    categories, and each process keeps the categories of the current version.
+    Without one, a change is seen at once only by the process, which made
+    it, so the categories of a process are also reloaded after
+    local_timeout seconds, which bounds how long other processes of a
+    deployment serve stale categories.
+    """
+
+    VERSION_KEY = "categories_version"
+
+    def __init__(self, load, backend=None, timeout=3600, local_timeout=60):
+        """
+        Constructor of CategoryCache class.
+        :param load: Function, which queries all categories.
+        :param backend: werkzeug.contrib.cache cache shared by processes, or
+                        None to cache in this process only.
+        :param timeout: Seconds the shared cache keeps the categories of a
+                        version.
+        :param local_timeout: Seconds the categories are kept without a
+                              backend, until they are loaded again.
+        :return:
+        """
+        self.load = load
+        self.backend = backend
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self.lock = threading.Lock()
+        self.version = 0
+        self.snapshot = None
+
+    def current_version(self):
+        """
+        Get the version of the categories.
+        :return: The version.
+        """
+        if self.backend is None:
+            return self.version
+        return self.backend.get(self.VERSION_KEY) or 0
+
+    def invalidate(self):
+        """
+        Increment the version after the categories have been changed and
+        committed, so that they are loaded again.
+        :return:
+        """
+        if self.backend is None:
+            with self.lock:
+                self.version += 1
+        else:
+            self.backend.add(self.VERSION_KEY, 0, timeout=0)
+            self.backend.inc(self.VERSION_KEY)
+
+    def __snapshot(self):
+        """
+        Get the categories of the current version, and load them if they are
+        not cached. Categories loaded while the version changes are kept
+        under the older version, so they are not used after the change.
+        :return: Tuple of the version, the list of categories, the
+                 dictionary of category ID to category and the time, after
+                 which the snapshot is loaded again without a backend.
+        """
+        version = self.current_version()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot[0] == version and \
+                (self.backend is not None or time.time() < snapshot[3]):
+            return snapshot
+        categories = None
+        key = "categories:%d" % version
+        if self.backend is not None:
+            categories = self.backend.get(key)
+        if categories is None:
+            categories = [CachedCategory(c.id, c.name, c.description,
+                                         c.user_id) for c in self.load()]
+            if self.backend is not None:
+                self.backend.set(key, categories, timeout=self.timeout)
+        snapshot = (version, categories,
+                    dict((category.id, category) for category in categories),
+                    time.time() + self.local_timeout)
+        self.snapshot = snapshot
+        return snapshot
+
+    def categories(self):
+        """
+        Get all categories.
+        :return: List of CachedCategory.
+        """
+        return self.__snapshot()[1]
+
+    def index(self):
+        """
+        Get the dictionary of category ID to category, so that a page can
+        look up the categories of its items in O(1) each.
+        :return: Dictionary of category ID to CachedCategory.
+        """
+        return self.__snapshot()[2]
+
+    def category(self, category_id):
+        """
+        Get the category of the given ID.
+        :param category_id: category ID.
+        :return: CachedCategory, or None if there is no such category.
+        """
+        return self.__snapshot()[2].get(category_id)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Test cases for application.py
+
+The pages are requested through the Flask test client against an in-memory
+SQLite database, and the queries of each page are counted by the
+X-Query-Count header.
+"""
+
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from application import app, session, category_cache
+from database_setup import Base, User, Category, Item
+
+# Queries of each page with the categories cached, which must not grow with
+# the number of items.
+PAGES = {
+    "/catalog/": 1,
+    "/category/1/items/": 1,
+    "/category/1/items/json": 1,
+    "/category/1/items/1/json": 1,
+    "/category/json": 0,
+}
+
+# Queries of the pages of a logged in user, who owns category 1 and item 1,
+# but not category 2 and the items in it.
+OWNER_PAGES = {
+    "/category/1/edit/": 1,
+    "/category/1/delete/": 1,
+    "/category/2/edit/": 1,
+    "/category/1/item/new/": 0,
+    "/category/1/items/1/edit": 1,
+    "/category/1/items/1/delete": 1,
+    "/category/2/items/2/edit": 1,
+    "/category/2/items/2/delete": 1,
+}
+
+
+def setup_database():
+    """
+    Bind the application to an in-memory database with two users, each of
+    which owns a category with an item.
+    :return:
+    """
+    engine = create_engine("sqlite://",
+                           connect_args={"check_same_thread": False},
+                           poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    session.remove()
+    session.configure(bind=engine)
+    for user_id in (1, 2):
+        session.add(User(id=user_id, name="User %d" % user_id,
+                         email="user.%d@gmail.com" % user_id))
+        session.add(Category(id=user_id, name="Category %d" % user_id,
+                             description="", user_id=user_id))
+        session.add(Item(id=user_id, name="Item %d" % user_id,
+                         description="", category_id=user_id,
+                         user_id=user_id, date=date.today()))
+    session.commit()
+    session.remove()
+    category_cache.invalidate()
+    app.secret_key = "catalog_test"
+
+
+def add_items(count):
+    """
+    Add items to both categories.
+    :param count: Number of items to add to each category.
+    :return:
+    """
+    for i in xrange(count):
+        for user_id in (1, 2):
+            session.add(Item(name="Item %d-%d" % (user_id, i),
+                             description="", category_id=user_id,
+                             user_id=user_id, date=date.today()))
+    session.commit()
+    session.remove()
+
+
+def query_count(client, path):
+    """
+    Request a page and get the number of queries it ran.
+    :param client: Flask test client.
+    :param path: Path of the page.
+    :return: The number of queries.
+    """
+    response = client.get(path)
+    if response.status_code not in (200, 302):
+        raise ValueError("%s returned %d." % (path, response.status_code))
+    return int(response.headers["X-Query-Count"])
+
+
+def check_query_counts(client, pages):
+    """
+    Check every page runs the expected number of queries.
+    :param client: Flask test client.
+    :param pages: Dictionary of the path to the expected queries.
+    :return:
+    """
+    for path, expected in sorted(pages.items()):
+        count = query_count(client, path)
+        if count != expected:
+            raise ValueError("%s ran %d queries instead of %d." %
+                             (path, count, expected))
+
+
+def test_category_cache():
+    """
+    Test the categories are queried once after they have been changed.
+    :return:
+    """
+    client = app.test_client()
+    category_cache.invalidate()
+    if query_count(client, "/category/json") != 1 or \
+            query_count(client, "/category/json") != 0:
+        raise ValueError("Categories should be queried only after a change.")
+    print "1. Categories are cached until they are changed."
+
+
+def test_page_queries():
+    """
+    Test the pages run a fixed number of queries for any number of items.
+    :return:
+    """
+    client = app.test_client()
+    query_count(client, "/category/json")
+    for count in (0, 10, 100):
+        add_items(count)
+        check_query_counts(client, PAGES)
+    print "2. Pages run a fixed number of queries for any number of items."
+
+
+def test_owner_page_queries():
+    """
+    Test the pages of a logged in user, including the permission checks,
+    run a fixed number of queries.
+    :return:
+    """
+    client = app.test_client()
+    with client.session_transaction() as login_session:
+        login_session["username"] = "User 1"
+        login_session["user_id"] = 1
+    query_count(client, "/category/json")
+    for count in (0, 10):
+        add_items(count)
+        check_query_counts(client, OWNER_PAGES)
+    print "3. Permission checks read the owner with the item or category."
+
+
+def test_uncached_categories():
+    """
+    Test the latest items are shown when their category is missing from the
+    cache, because it was created by another process or deleted. The item
+    is dated tomorrow to be the latest.
+    :return:
+    """
+    client = app.test_client()
+    query_count(client, "/category/json")
+    session.add(Category(id=3, name="Category 3", description="", user_id=1))
+    session.add(Item(id=3, name="Item 3", description="", category_id=3,
+                     user_id=1, date=date.today() + timedelta(days=1)))
+    session.commit()
+    session.remove()
+    response = client.get("/catalog/")
+    if response.status_code != 200 or "Category 3" not in response.data:
+        raise ValueError("Categories missing from the cache should be read.")
+    if category_cache.category(3) is None:
+        raise ValueError("Cache should be reloaded after a missing category.")
+    session.query(Category).filter_by(id=3).delete()
+    session.commit()
+    session.remove()
+    category_cache.invalidate()
+    response = client.get("/catalog/")
+    if response.status_code != 200 or "Item 3" not in response.data:
+        raise ValueError("Items of a deleted category should be shown.")
+    print "4. Latest items are shown with categories missing from the cache."
+
+
+def test_uncached_category_page():
+    """
+    Test the page of a category missing from the cache is shown, and an
+    unknown category is not found.
+    :return:
+    """
+    client = app.test_client()
+    query_count(client, "/category/json")
+    session.add(Category(id=4, name="Category 4", description="", user_id=1))
+    session.commit()
+    session.remove()
+    if client.get("/category/4/items/").status_code != 200:
+        raise ValueError("Categories missing from the cache should be read.")
+    if category_cache.category(4) is None:
+        raise ValueError("Cache should be reloaded after a missing category.")
+    if client.get("/category/5/items/").status_code != 404:
+        raise ValueError("Unknown categories should not be found.")
+    print "5. Categories missing from the cache are read from the database."
+
+
+if __name__ == '__main__':
+    setup_database()
+    test_category_cache()
+    test_page_queries()
+    test_owner_page_queries()
+    test_uncached_categories()
+    test_uncached_category_page()
+    print "Success!  All tests pass!"
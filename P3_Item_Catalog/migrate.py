@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Schema migrations
+migrate.py -- upgrade an existing catalog database to the schema of
+database_setup.py without losing data.
+
+Migrations are applied in order, and the last one applied is recorded in the
+alembic_version table like Alembic does, so each runs once per database and
+Alembic can take over the history later. The statements run on SQLite and
+PostgreSQL.
+
+    python migrate.py             # upgrade to the latest version
+    python migrate.py current     # show the version of the database
+    python migrate.py downgrade 0 # undo all migrations
+"""
+
+import argparse
+
+from database_setup import engine
+
+
+def upgrade_001(conn):
+    """
+    Index the hot queries of the catalog. Users, who were created more than
+    once for the same email, are merged into the first one before the email
+    becomes unique.
+    :param conn: Connection in the transaction of the migration.
+    :return:
+    """
+    duplicate = "select id from users where exists (select 1 from users " \
+                "as kept where kept.email = users.email and " \
+                "kept.id < users.id)"
+    kept = "(select min(kept.id) from users as kept join users as " \
+           "duplicate on duplicate.email = kept.email where " \
+           "duplicate.id = %s.user_id)"
+    for table in ("categories", "items"):
+        conn.execute("update %s set user_id = %s where user_id in (%s)" %
+                     (table, kept % table, duplicate))
+    conn.execute("delete from users where id in (select id from (%s) as "
+                 "duplicates)" % duplicate)
+    conn.execute("create unique index if not exists users_email_idx "
+                 "on users (email)")
+    conn.execute("create index if not exists items_date_idx on items (date)")
+    conn.execute("create index if not exists items_category_name_idx "
+                 "on items (category_id, name)")
+
+
+def downgrade_001(conn):
+    """
+    Drop the indexes of upgrade_001. Merged users are not split again.
+    :param conn: Connection in the transaction of the migration.
+    :return:
+    """
+    conn.execute("drop index if exists items_category_name_idx")
+    conn.execute("drop index if exists items_date_idx")
+    conn.execute("drop index if exists users_email_idx")
+
+
+# Versions in order with their upgrade and downgrade.
+MIGRATIONS = [
+    ("001", upgrade_001, downgrade_001),
+]
+
+
+def current_version(conn):
+    """
+    Get the version of the database.
+    :param conn: Database connection.
+    :return: The version, or "0" if no migration has been applied.
+    """
+    conn.execute("create table if not exists alembic_version "
+                 "(version_num varchar(32) not null primary key)")
+    version = conn.execute("select version_num from alembic_version")\
+        .scalar()
+    return version or "0"
+
+
+def set_version(conn, version):
+    """
+    Record the version of the database.
+    :param conn: Database connection.
+    :param version: The version, "0" for none.
+    :return:
+    """
+    conn.execute("delete from alembic_version")
+    if version != "0":
+        conn.execute("insert into alembic_version (version_num) values "
+                     "('%s')" % version)
+
+
+def upgrade(target=None):
+    """
+    Apply the migrations after the version of the database up to target,
+    each in its own transaction.
+    :param target: Version to upgrade to, the latest if None.
+    :return: The version of the database.
+    """
+    versions = [m[0] for m in MIGRATIONS]
+    target = target or versions[-1]
+    if target not in versions:
+        raise ValueError("Unknown version, %s" % target)
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for migration_version, up, down in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        if migration_version > target:
+            break
+        with engine.begin() as conn:
+            up(conn)
+            set_version(conn, migration_version)
+        version = migration_version
+        print "Upgraded to %s." % version
+    return version
+
+
+def downgrade(target):
+    """
+    Undo the migrations after target down from the version of the database,
+    each in its own transaction.
+    :param target: Version to downgrade to, "0" for none.
+    :return: The version of the database.
+    """
+    versions = ["0"] + [m[0] for m in MIGRATIONS]
+    if target not in versions:
+        raise ValueError("Unknown version, %s" % target)
+    with engine.begin() as conn:
+        version = current_version(conn)
+    for i in xrange(len(MIGRATIONS) - 1, -1, -1):
+        migration_version, up, down = MIGRATIONS[i]
+        if migration_version > version:
+            continue
+        if migration_version <= target:
+            break
+        with engine.begin() as conn:
+            down(conn)
+            set_version(conn, versions[i])
+        version = versions[i]
+        print "Downgraded to %s." % version
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate the catalog database.")
+    parser.add_argument("command", nargs="?", default="upgrade",
+                        choices=("upgrade", "downgrade", "current"))
+    parser.add_argument("version", nargs="?",
+                        help="version to upgrade or downgrade to")
+    args = parser.parse_args()
+    if args.command == "current":
+        with engine.begin() as conn:
+            print current_version(conn)
+    elif args.command == "upgrade":
+        upgrade(args.version)
+    elif args.version is None:
+        parser.error("downgrade needs the version to downgrade to")
+    else:
+        downgrade(args.version)
+
+
+if __name__ == '__main__':
+    main()
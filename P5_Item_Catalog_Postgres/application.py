@@ -1,9 +1,11 @@
 from settings import *
 from flask import Flask, render_template, request, redirect, jsonify, url_for,\
-    flash
-from sqlalchemy import create_engine, desc, asc
-from sqlalchemy.orm import sessionmaker
+    flash, abort, g, has_app_context
+from sqlalchemy import create_engine, desc, asc, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session, sessionmaker, joinedload
 from database_setup import Base, User, Category, Item
+from cache import CategoryCache
 from flask import session as login_session
 import random, string
 from oauth2client.client import flow_from_clientsecrets
@@ -22,11 +24,58 @@ app.secret_key = 'super_secret_key'
 CLIENT_ID = json.loads(open("client_secrets.json", "r").read())["web"]["client_id"]
 APPLICATION_NAME = "Item Catalog"
 
-engine = create_engine("postgresql+psycopg2://%s:%s@%s:%d/%s" % (db_user, db_password, db_host, db_port, db_name))
+engine = create_engine("postgresql+psycopg2://%s:%s@%s:%d/%s" % (db_user, db_password, db_host, db_port, db_name),
+                       pool_size=db_pool_size, max_overflow=db_max_overflow,
+                       pool_pre_ping=db_pool_pre_ping,
+                       pool_recycle=db_pool_recycle)
 Base.metadata.bind = engine
 
+# Every thread gets its own session, which is removed at the end of the
+# request, so requests neither share a connection nor loaded objects.
 DBSession = sessionmaker(bind=engine)
-session = DBSession()
+session = scoped_session(DBSession)
+
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    """
+    Remove the session of the request and return its connection to the pool.
+    :param exception: Exception, which ended the request, if any.
+    :return:
+    """
+    session.remove()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Count the queries of the request in g.query_count. The arguments are
+    those of the before_cursor_execute event of SQLAlchemy.
+    :return:
+    """
+    if has_app_context():
+        g.query_count = getattr(g, "query_count", 0) + 1
+
+
+@app.after_request
+def report_query_count(response):
+    """
+    Report the number of queries of the request in the X-Query-Count header
+    and the debug log, so that pages, which query once per row, are noticed.
+    :param response: Response of the request.
+    :return: The response.
+    """
+    query_count = getattr(g, "query_count", 0)
+    response.headers["X-Query-Count"] = str(query_count)
+    app.logger.debug("%s %s: %d queries", request.method, request.path,
+                     query_count)
+    return response
+
+# Categories are read by almost every page, so they are cached. Set
+# category_cache_backend in settings.py to share them between processes.
+category_cache = CategoryCache(lambda: session.query(Category).all(),
+                               category_cache_backend,
+                               local_timeout=category_cache_local_timeout)
 
 ##
 # Routing functions
@@ -39,7 +88,7 @@ def category_item_json(category_id):
     :param category_id: category ID
     :return: Category items in JSON format.
     """
-    category = session.query(Category).filter_by(id=category_id).one()
+    category = get_category_by_id(category_id)
     items = session.query(Item).filter_by(category_id=category.id).all()
     return jsonify(items=[i.serialize for i in items])
 
@@ -212,8 +261,11 @@ def show_catalog():
     Show all categories and latest 20 items.
     :return: show all categories and latest 20 items.
     """
+    items = get_latest_items()
+    category_index = get_category_index(items)
     return render_template("latest_item.html", categories=get_categories(),
-                           items=get_latest_items(), login_session=login_session)
+                           category_index=category_index, items=items,
+                           login_session=login_session)
 
 
 @app.route("/category/new/", methods=["GET", "POST"])
@@ -231,6 +283,7 @@ def new_category():
                                     user_id=login_session["user_id"])
             session.add(category)
             session.commit()
+            category_cache.invalidate()
         else:
             flash("Name is required. Please specify category name.")
             return render_template("new_category.html", login_session=login_session)
@@ -248,9 +301,10 @@ def edit_category(category_id):
     """
     if "username" not in login_session:
         return redirect("/login")
-    category = session.query(Category).filter_by(id=category_id).one()
+    category = session.query(Category).options(joinedload(Category.user))\
+        .filter_by(id=category_id).one()
     if category.user_id != login_session["user_id"]:
-        user = get_user_info(category.user_id)
+        user = category.user
         flash("%s is created by other user, %s. You are not authorized \
               to edit this. " % (category.name, user.email))
         return redirect(url_for("show_catalog"))
@@ -261,6 +315,7 @@ def edit_category(category_id):
             category.description = request.form["description"]
         session.add(category)
         session.commit()
+        category_cache.invalidate()
         return redirect(url_for("show_catalog"))
     else:
         return render_template("edit_category.html", category=category,
@@ -275,15 +330,17 @@ def delete_category(category_id):
     """
     if "username" not in login_session:
         return redirect("/login")
-    category = session.query(Category).filter_by(id=category_id).one()
+    category = session.query(Category).options(joinedload(Category.user))\
+        .filter_by(id=category_id).one()
     if category.user_id != login_session["user_id"]:
-        user = get_user_info(category.user_id)
+        user = category.user
         flash("%s is created by other user, %s. You are not authorized \
               to delete this. " % (category.name, user.email))
         return redirect(url_for("show_catalog"))
     if request.method == "POST":
         session.delete(category)
         session.commit()
+        category_cache.invalidate()
         return redirect(url_for("show_catalog"))
     else:
         return render_template("delete_category.html", category=category,
@@ -297,8 +354,9 @@ def show_items(category_id):
     :param category_id: category ID.
     :return: Item list page.
     """
-    category = session.query(Category).filter_by(id=category_id).one()
-    items = session.query(Item).filter_by(category_id=category_id).all()
+    category = get_category_by_id(category_id)
+    items = session.query(Item).filter_by(category_id=category_id)\
+        .order_by(asc(Item.name)).all()
     return render_template("item.html", categories=get_categories(),
                            items=items, category=category,
                            login_session=login_session)
@@ -329,8 +387,7 @@ def new_item(category_id):
                                    category_id=category_id,
                                    login_session=login_session)
 
-        return redirect(url_for("show_items", categories=get_categories(),
-                                category_id=category_id))
+        return redirect(url_for("show_items", category_id=category_id))
     else:
         return render_template("new_item.html", categories=get_categories(),
                                category_id=category_id,
@@ -347,13 +404,13 @@ def edit_item(category_id, item_id):
     """
     if "username" not in login_session:
         return redirect("/login")
-    item = session.query(Item).filter_by(id=item_id).one()
+    item = session.query(Item).options(joinedload(Item.user))\
+        .filter_by(id=item_id).one()
     if item.user_id != login_session["user_id"]:
-        user = get_user_info(item.user_id)
+        user = item.user
         flash("%s is created by other user, %s. You are not authorized \
               to edit this. " % (item.name, user.email))
-        return redirect(url_for("show_items", categories=get_categories(),
-                                category_id=category_id))
+        return redirect(url_for("show_items", category_id=category_id))
     if request.method == "POST":
         if request.form["name"]:
             item.name = request.form["name"]
@@ -364,8 +421,7 @@ def edit_item(category_id, item_id):
         item.user_id = login_session["user_id"]
         session.add(item)
         session.commit()
-        return redirect(url_for("show_items", categories=get_categories(),
-                                category_id=category_id))
+        return redirect(url_for("show_items", category_id=category_id))
     else:
         return render_template("edit_item.html", categories=get_categories(),
                                category_id=category_id,
@@ -383,18 +439,17 @@ def delete_item(category_id, item_id):
     """
     if "username" not in login_session:
         return redirect("/login")
-    item = session.query(Item).filter_by(id=item_id).one()
+    item = session.query(Item).options(joinedload(Item.user))\
+        .filter_by(id=item_id).one()
     if item.user_id != login_session["user_id"]:
-        user = get_user_info(item.user_id)
+        user = item.user
         flash("%s is created by other user, %s. You are not authorized \
               to delete this. " % (item.name, user.email))
-        return redirect(url_for("show_items", categories=get_categories(),
-                                category_id=category_id))
+        return redirect(url_for("show_items", category_id=category_id))
     if request.method == "POST":
         session.delete(item)
         session.commit()
-        return redirect(url_for("show_items", categories=get_categories(),
-                                category_id=category_id))
+        return redirect(url_for("show_items", category_id=category_id))
     else:
         return render_template("delete_item.html", item=item,
                                login_session=login_session)
@@ -414,18 +469,10 @@ def create_user(login_session):
                    email=login_session["email"],
                    picture=login_session["picture"])
     session.add(newUser)
+    session.flush()
+    user_id = newUser.id
     session.commit()
-    user = session.query(User).filter_by(email=login_session['email']).one()
-    return user.id
-
-def get_user_info(user_id):
-    """
-    Get user information.
-    :param user_id: user ID.
-    :return: User for the given user ID.
-    """
-    user = session.query(User).filter_by(id=user_id).one()
-    return user
+    return user_id
 
 def get_user_id(email):
     """
@@ -441,11 +488,48 @@ def get_user_id(email):
 
 def get_categories():
     """
-    Get all categories defined in the database.
-    :return: All categories.
+    Get all categories from category_cache, which queries the database only
+    after the categories have been changed.
+    :return: All categories as cache.CachedCategory.
     """
-    categories = session.query(Category).all()
-    return categories
+    return category_cache.categories()
+
+def get_category_by_id(category_id):
+    """
+    Get the category for the given category ID from category_cache. A
+    category missing from the cache, like one created by another process, is
+    queried from the database, and the cache is invalidated if it exists.
+    :param category_id: category ID.
+    :return: cache.CachedCategory or Category. 404 if there is no such
+             category.
+    """
+    category = category_cache.category(category_id)
+    if category is None:
+        category = session.query(Category).get(category_id)
+        if category is None:
+            abort(404)
+        category_cache.invalidate()
+    return category
+
+def get_category_index(items):
+    """
+    Get the categories of the given items from category_cache. Categories
+    missing from the cache, like those created by another process, are
+    queried from the database, and the cache is invalidated if any exist.
+    :param items: items to look up the categories of.
+    :return: Dictionary of category ID to category. Categories, which do not
+             exist any more, are missing.
+    """
+    index = category_cache.index()
+    missing = set(item.category_id for item in items) - set(index)
+    if missing:
+        categories = session.query(Category).filter(
+            Category.id.in_(missing)).all()
+        if categories:
+            category_cache.invalidate()
+            index = dict(index)
+            index.update((category.id, category) for category in categories)
+    return index
 
 def get_latest_items():
     """
@@ -455,21 +539,7 @@ def get_latest_items():
     items = session.query(Item).order_by(desc(Item.date)).limit(20).all()
     return items
 
-@app.template_global()
-def get_category(categories, category_id):
-    """
-    Get Category for the given category ID.
-    :param categories: all categories.
-    :param category_id: category ID.
-    :return: Category for the given category ID.
-    """
-    for category in categories:
-        if category.id == category_id:
-            return category
-    return None
-
 if __name__ == "__main__":
     app.secret_key = 'super_secret_key'
     app.debug = True
-    app.jinja_env.globals.update(get_category=get_category)
     app.run(host="0.0.0.0", port=8000)
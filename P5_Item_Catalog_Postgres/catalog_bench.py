@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Benchmarks for application.py
+catalog_bench.py -- measure the catalog pages against the item_catalog
+database.
+
+By default, a load test requests the catalog pages from an increasing number
+of worker threads and reports the throughput and latency percentiles of each
+number of threads. Pages are requested through the Flask test client, or over
+HTTP from a running server, like the mod_wsgi deployment, with --url. The
+other benchmarks can be run by name, e.g. "python catalog_bench.py render".
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+# Pages requested by the load test, in turn.
+PAGES = ("/catalog/", "/category/1/items/", "/category/json")
+
+
+def percentile(values, p):
+    """
+    Get the percentile of sorted values by the nearest rank.
+    :param values: Sorted list of values.
+    :param p: Percentile between 0 and 100.
+    :return: The value at the percentile.
+    """
+    return values[int(round(p / 100.0 * (len(values) - 1)))]
+
+
+def make_client(url=None):
+    """
+    Make a function, which requests a page and returns the status code.
+    :param url: URL of a running server. The Flask test client if None.
+    :return: Function of the path of the page.
+    """
+    if url is None:
+        from application import app
+        client = app.test_client()
+        return lambda path: client.get(path).status_code
+    client = requests.Session()
+    return lambda path: client.get(url + path).status_code
+
+
+def bench_load(threads=(1, 2, 4, 8, 16), seconds=5, url=None, pages=PAGES):
+    """
+    Request the pages from each number of worker threads for the given
+    time. Each thread has its own client, and every request its own
+    database session, so the throughput should grow with the threads until
+    the connection pool or the database is saturated.
+    :param threads: The numbers of worker threads to measure.
+    :param seconds: Time to measure each number of threads.
+    :param url: URL of a running server. The Flask test client if None.
+    :param pages: Paths of the pages to request in turn.
+    :return:
+    """
+    print "load test of %s: threads, requests/sec, p50 msec, p99 msec, " \
+          "errors" % (url or "test client")
+    for count in threads:
+        latencies = []
+        errors = []
+
+        def worker():
+            get = make_client(url)
+            times = []
+            failed = 0
+            i = 0
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                start = time.time()
+                status = get(pages[i % len(pages)])
+                times.append(time.time() - start)
+                if status != 200:
+                    failed += 1
+                i += 1
+            latencies.extend(times)
+            errors.append(failed)
+        workers = [threading.Thread(target=worker) for i in xrange(count)]
+        start = time.time()
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        wall = time.time() - start
+        latencies.sort()
+        print "%d, %.1f, %.2f, %.2f, %d" % (
+            count, len(latencies) / wall, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, sum(errors))
+
+
+class ScanIndex(object):
+    """ Category lookup by scanning all categories, like the latest items
+    were rendered before the categories were indexed. """
+
+    def __init__(self, categories):
+        self.categories = categories
+
+    def get(self, category_id):
+        for category in self.categories:
+            if category.id == category_id:
+                return category
+        return None
+
+
+def bench_render(categories=10000, items=20, renders=100):
+    """
+    Render the page of show_catalog with many categories, looking up the
+    category of each latest item by the index of category_cache and by
+    scanning the categories. Nothing is read from the database.
+    :param categories: Number of categories.
+    :param items: Number of latest items, each in a different category.
+    :param renders: Renders to measure for each lookup.
+    :return:
+    """
+    from flask import render_template
+    from application import app
+    from cache import CachedCategory
+    from database_setup import Item
+    category_list = [CachedCategory(i, "Category %d" % i, "", 1)
+                     for i in xrange(1, categories + 1)]
+    index = dict((category.id, category) for category in category_list)
+    # The latest items are in the last categories, the worst case of a scan.
+    latest = [Item(id=i, name="Item %d" % i, description="",
+                   category_id=categories - i, user_id=1)
+              for i in xrange(items)]
+    login = {"username": "bench", "user_id": 1}
+    print "render show_catalog with %d categories and %d items: lookup, " \
+          "p50 msec, p99 msec" % (categories, items)
+    for name, category_index in (("index", index),
+                                 ("scan", ScanIndex(category_list))):
+        times = []
+        with app.test_request_context("/catalog/"):
+            for i in xrange(renders):
+                start = time.time()
+                render_template("latest_item.html", categories=category_list,
+                                category_index=category_index, items=latest,
+                                login_session=login)
+                times.append(time.time() - start)
+        times.sort()
+        print "%s, %.2f, %.2f" % (name, percentile(times, 50) * 1000,
+                                  percentile(times, 99) * 1000)
+
+
+def bench_indexes(items=1000000, categories=1000, queries=50,
+                  url="sqlite://"):
+    """
+    Measure the queries of the latest items and of a category page without
+    and with the indexes of the items table. The tables are dropped and
+    filled with the given number of items, so url must be a scratch
+    database.
+    :param items: Number of items.
+    :param categories: Number of categories, which the items are spread over.
+    :param queries: Queries to measure of each page with and without indexes.
+    :param url: SQLAlchemy URL of the scratch database.
+    :return:
+    """
+    from sqlalchemy import create_engine, desc, asc
+    from sqlalchemy.orm import sessionmaker
+    from database_setup import Base, User, Category, Item
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    start = datetime(2015, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(),
+                     [{"id": 1, "name": "Bench", "email": "bench@gmail.com"}])
+        conn.execute(Category.__table__.insert(),
+                     [{"id": i, "name": "Category %d" % i, "description": "",
+                       "user_id": 1} for i in xrange(1, categories + 1)])
+        for first in xrange(0, items, 10000):
+            conn.execute(Item.__table__.insert(),
+                         [{"name": "Item %d" % i, "description": "",
+                           "category_id": i % categories + 1, "user_id": 1,
+                           "date": start + timedelta(minutes=i)}
+                          for i in xrange(first, min(first + 10000, items))])
+    session = sessionmaker(bind=engine)()
+    print "queries of %d items in %d categories: indexes, page, p50 msec, " \
+          "p99 msec" % (items, categories)
+    for indexed in (False, True):
+        for index in Item.__table__.indexes:
+            if indexed:
+                index.create(engine)
+            else:
+                index.drop(engine)
+        pages = (("latest", lambda: session.query(Item)
+                  .order_by(desc(Item.date)).limit(20).all()),
+                 ("category", lambda: session.query(Item)
+                  .filter_by(category_id=random.randint(1, categories))
+                  .order_by(asc(Item.name)).all()))
+        for name, query in pages:
+            times = []
+            for i in xrange(queries):
+                begin = time.time()
+                query()
+                times.append(time.time() - begin)
+                session.expunge_all()
+            times.sort()
+            print "%s, %s, %.2f, %.2f" % (
+                "with" if indexed else "without", name,
+                percentile(times, 50) * 1000, percentile(times, 99) * 1000)
+    session.close()
+
+
+BENCHMARKS = {
+    "load": bench_load,
+    "render": bench_render,
+    "indexes": bench_indexes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the item catalog application.")
+    parser.add_argument("benchmarks", nargs="*", default=["load"],
+                        help="benchmarks to run, out of %s (default: load)" %
+                             ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument("--url", help="URL of a running server for the load "
+                                      "test, like http://localhost")
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=[1, 2, 4, 8, 16],
+                        help="numbers of worker threads of the load test")
+    parser.add_argument("--seconds", type=float, default=5,
+                        help="seconds to measure each number of threads")
+    parser.add_argument("--scratch-url", default="sqlite://",
+                        help="SQLAlchemy URL of a scratch database for the "
+                             "indexes benchmark, which drops its tables "
+                             "(default: in-memory SQLite)")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark, %s" % name)
+    for name in args.benchmarks:
+        if name == "load":
+            bench_load(args.threads, args.seconds, args.url)
+        elif name == "indexes":
+            bench_indexes(url=args.scratch_url)
+        else:
+            BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
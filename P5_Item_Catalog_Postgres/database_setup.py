@@ -1,7 +1,7 @@
 import os
 import sys
 from settings import *
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
@@ -12,6 +12,8 @@ Base = declarative_base()
 class User(Base):
     """ users table definition. """
     __tablename__ = "users"
+    # Users are looked up by email on every login.
+    __table_args__ = (Index("users_email_idx", "email", unique=True), )
 
     id = Column(Integer, primary_key=True)
     email = Column(String(250), nullable=False)
@@ -53,6 +55,10 @@ class Category(Base):
 class Item(Base):
     """ items table definition. """
     __tablename__ = "items"
+    # The latest items are read by date, and the items of a category by
+    # category_id in the order of their names.
+    __table_args__ = (Index("items_date_idx", "date"),
+                      Index("items_category_name_idx", "category_id", "name"))
 
     name = Column(String(250), nullable=False)
     id = Column(Integer, primary_key=True)
@@ -4,3 +4,22 @@ db_password = "udacity"
 db_host = "localhost"
 db_port = 5432
 db_name = "item_catalog"
+
+# connection pool of the application. Every mod_wsgi thread holds at most one
+# connection during a request, so pool_size should match the threads of the
+# WSGIDaemonProcess, and the overflow covers other threads and scripts.
+# Connections are checked before use and replaced after db_pool_recycle
+# seconds, so that connections dropped by the server are not handed out.
+db_pool_size = 10
+db_max_overflow = 5
+db_pool_pre_ping = True
+db_pool_recycle = 1800
+
+# werkzeug cache shared by the processes of the application for the
+# categories, like werkzeug.contrib.cache.MemcachedCache(["127.0.0.1:11211"]).
+# None caches the categories in each process, which is enough for a single
+# WSGIDaemonProcess. With more processes and no shared cache, a process sees
+# the category changes of the others only when its categories expire after
+# category_cache_local_timeout seconds.
+category_cache_backend = None
+category_cache_local_timeout = 60